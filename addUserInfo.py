@@ -1,35 +1,16 @@
 import pandas as pd
-import pyodbc
-from io import StringIO
-
-# Leer el archivo CSV eliminando las comillas alrededor de cada fila
-with open('archiSinComillas.csv', 'r') as file:
-    lines = [line.strip('"') for line in file]
-
-# Crear un nuevo DataFrame a partir de las líneas corregidas
-df = pd.read_csv(StringIO('\n'.join(lines)))
-
-# Define una función para obtener FULL_NAME, EMAIL y DATABASE_NAME basados en el número de seguimiento
-def get_full_name_email(tracking_number, connection_string, database_name):
-    conn = pyodbc.connect(connection_string)
-    sql_query = f"""
-    SELECT FULL_NAME, EMAIL
-    FROM [USER]
-    WHERE USER_ID = (SELECT USER_ID FROM SHIPMENT WHERE TRACKING_NUMBER = '{tracking_number}');
-    """
-    sql_result = pd.read_sql_query(sql_query, conn)
-    conn.close()
-    if not sql_result.empty and 'FULL_NAME' in sql_result.columns and 'EMAIL' in sql_result.columns:
-        return sql_result.iloc[0]['FULL_NAME'], sql_result.iloc[0]['EMAIL'], database_name
-    else:
-        return None, None, None  # Return None for all values if no rows found or missing columns
-
-# Crear nuevas columnas para almacenar FULL_NAME, EMAIL y DATABASE_NAME
-df['FULL_NAME'] = ''
-df['EMAIL'] = ''
-df['DATABASE_NAME'] = ''
-
-# Define cadenas de conexión y nombres de bases de datos correspondientes
+import typer
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Instrumentation
+from lookup_cache import TrackingCache
+from models import FIELD_NAMES
+from normalizer import normalize_file, normalized_path
+
+# SQL Server admite como máximo 2100 parámetros por consulta
+CHUNK_SIZE = 1000
+
+# Define cadenas de conexión y nombres de bases de datos correspondientes, en orden de prioridad
 connections_info = [
     {
         'connection_string': 'Driver={SQL Server};Server=localhost;Database=esurex;Trusted_Connection=yes;',
@@ -50,20 +31,109 @@ connections_info = [
     # Agregar cadenas de conexión y nombres de bases de datos para las otras bases de datos aquí
 ]
 
-# Recorrer cada fila en el DataFrame
-for index, row in df.iterrows():
-    tracking_number = row['AIRBILL #']  # Reemplazar 'AIRBILL #' con el nombre de columna real
-    for connection_info in connections_info:
-        full_name, email, database_name = get_full_name_email(
-            tracking_number,
-            connection_info['connection_string'],
-            connection_info['database_name']
-        )
-        if full_name is not None:
-            df.at[index, 'FULL_NAME'] = full_name
-            df.at[index, 'EMAIL'] = email
-            df.at[index, 'DATABASE_NAME'] = database_name
-            break  # Salir del bucle una vez que se encuentren datos en una base de datos
-
-# Guardar el DataFrame actualizado en un nuevo archivo CSV
-df.to_csv('tu_output.csv', index=False)
+
+def pyodbc_connect(connection_string):
+    import pyodbc
+    return pyodbc.connect(connection_string)
+
+
+def read_airbills(csv_name):
+    # Desenvuelve las filas entre comillas y completa las columnas antes de pasar el archivo a pandas
+    normalized_csv = normalized_path(csv_name)
+    report = normalize_file(csv_name, normalized_csv, FIELD_NAMES)
+    typer.echo(report.summary())
+    return pd.read_csv(normalized_csv)
+
+
+# Obtiene FULL_NAME y EMAIL de todos los números de seguimiento con una sola conexión y consultas por bloques
+def lookup_users(tracking_numbers, connection_string, database_name, connect=pyodbc_connect, chunk_size=CHUNK_SIZE):
+    conn = connect(connection_string)
+    try:
+        cursor = conn.cursor()
+        found = []
+        for start in range(0, len(tracking_numbers), chunk_size):
+            chunk = tracking_numbers[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f"""
+            SELECT SHIPMENT.TRACKING_NUMBER, [USER].FULL_NAME, [USER].EMAIL
+            FROM SHIPMENT
+            JOIN [USER] ON [USER].USER_ID = SHIPMENT.USER_ID
+            WHERE SHIPMENT.TRACKING_NUMBER IN ({placeholders});
+            """, chunk)
+            found.extend(tuple(row) for row in cursor.fetchall())
+    finally:
+        conn.close()
+    result = pd.DataFrame(found, columns=['TRACKING_NUMBER', 'FULL_NAME', 'EMAIL'])
+    result['DATABASE_NAME'] = database_name
+    return result
+
+
+# Agrega FULL_NAME, EMAIL y DATABASE_NAME consultando todas las bases de datos en paralelo
+def enrich(df, connections_info=connections_info, connect=pyodbc_connect, chunk_size=CHUNK_SIZE, cache=None):
+    tracking_keys = df['AIRBILL #'].astype(str)
+    tracking_numbers = list(tracking_keys[df['AIRBILL #'].notna()].unique())
+
+    # Solo se consultan las bases de datos para los números que no están en la caché
+    cached = {}
+    if cache is not None:
+        cached, tracking_numbers = cache.get_many(tracking_numbers)
+
+    results = []
+    if tracking_numbers:
+        with ThreadPoolExecutor(max_workers=max(1, len(connections_info))) as executor:
+            results = list(executor.map(
+                lambda info: lookup_users(tracking_numbers, info['connection_string'], info['database_name'],
+                                          connect, chunk_size),
+                connections_info
+            ))
+
+    # Si un número aparece en varias bases de datos gana la primera de connections_info, como antes
+    users = pd.concat(results, ignore_index=True) if results else \
+        pd.DataFrame(columns=['TRACKING_NUMBER', 'FULL_NAME', 'EMAIL', 'DATABASE_NAME'])
+    users['TRACKING_NUMBER'] = users['TRACKING_NUMBER'].astype(str)
+    users = users.drop_duplicates('TRACKING_NUMBER', keep='first').set_index('TRACKING_NUMBER')
+
+    if cache is not None:
+        found = {number: tuple(values) for number, values in
+                 zip(users.index, users[['FULL_NAME', 'EMAIL', 'DATABASE_NAME']].itertuples(index=False))}
+        cache.put_many(found, [number for number in tracking_numbers if number not in found])
+        hits = pd.DataFrame([(number,) + values for number, values in cached.items() if values is not None],
+                            columns=['TRACKING_NUMBER', 'FULL_NAME', 'EMAIL', 'DATABASE_NAME'])
+        users = pd.concat([users, hits.set_index('TRACKING_NUMBER')])
+
+    df = df.drop(columns=['FULL_NAME', 'EMAIL', 'DATABASE_NAME'], errors='ignore')
+    matched = users.reindex(tracking_keys)
+    for column in ['FULL_NAME', 'EMAIL', 'DATABASE_NAME']:
+        df[column] = matched[column].fillna('').to_numpy()
+    return df
+
+
+def main(csv_name: str = typer.Argument('archiSinComillas.csv'),
+         output: str = typer.Option('tu_output.csv', help="Enriched CSV to write"),
+         cache_path: str = typer.Option('tracking_cache.sqlite', help="On-disk tracking number cache"),
+         use_cache: bool = typer.Option(True, "--cache/--no-cache", help="Read and update the tracking number cache"),
+         rebuild_cache: bool = typer.Option(False, help="Discard every cached entry before enriching"),
+         found_ttl_days: float = typer.Option(30, help="Days a resolved tracking number stays cached"),
+         not_found_ttl_days: float = typer.Option(1, help="Days a tracking number missing everywhere stays cached"),
+         metrics: bool = typer.Option(True, help="Write stage timings to invoice_generator.log as JSON lines")):
+    instrumentation = Instrumentation(enabled=metrics)
+    cache = TrackingCache(cache_path, positive_ttl=found_ttl_days * 86400, negative_ttl=not_found_ttl_days * 86400,
+                          bypass=not use_cache, rebuild=rebuild_cache)
+    try:
+        with instrumentation.span('normalize'):
+            df = read_airbills(csv_name)
+        with instrumentation.span('enrichment', rows=len(df)):
+            df = enrich(df, cache=cache)
+    finally:
+        cache.close()
+    typer.echo(cache.stats())
+    instrumentation.count('tracking_cache_hits', cache.hits)
+    instrumentation.count('tracking_cache_misses', cache.misses)
+    # Guardar el DataFrame actualizado en un nuevo archivo CSV
+    with instrumentation.span('write_csv'):
+        df.to_csv(output, index=False)
+    instrumentation.close()
+
+
+if __name__ == '__main__':
+    typer.run(main)
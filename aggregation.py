@@ -0,0 +1,75 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from models import (CENTS_TOLERANCE, CHARGE_KEYS, MAX_FLOAT_CENTS, Invoice, LineItem, invoice_from_row, summary_items,
+                    to_cents)
+
+HEADER_COLUMNS = ["INVOICE DATE", "AIRBILL #", "CONSIGNEE ATTENTION", "CONSIGNEE ADDRESS 1", "CONSIGNEE ADDRESS 2",
+                  "BASE CHARGE AMOUNT", "SCAC", "FULL_NAME", "EMAIL", "DATABASE_NAME"]
+
+
+def _to_cents(values: np.ndarray) -> np.ndarray:
+    # models.to_cents over the whole column: whole cents straight from the floats, anything else value by value
+    strings = np.where(values == '', '0', values)
+    try:
+        numbers = strings.astype(np.float64)
+    except ValueError:
+        # Only a column with an invalid amount pays for the coercing parse; to_cents below raises on it
+        numbers = pd.to_numeric(strings, errors='coerce')
+    scaled = np.asarray(numbers, dtype=np.float64) * 100
+    cents = np.rint(scaled)
+    exact = (np.abs(scaled - cents) < CENTS_TOLERANCE) & (np.abs(scaled) < MAX_FLOAT_CENTS)
+    result = np.where(exact, cents, 0).astype(np.int64)
+    if not exact.all():
+        result[~exact] = [to_cents(value) for value in values[~exact]]
+    return result
+
+
+def _melt(frame: pd.DataFrame, slots: List[tuple]) -> tuple:
+    # Row-major ravel keeps the row order and, within a row, the slot order of the per-row loop
+    types = frame[[type_column for type_column, _ in slots]].to_numpy(dtype=object).ravel()
+    amounts = frame[[amount_column for _, amount_column in slots]].to_numpy(dtype=object).ravel()
+    rows = np.repeat(np.arange(len(frame)), len(slots))
+    present = (types != '') & (amounts != '')
+    return rows[present], types[present], _to_cents(amounts[present])
+
+
+def columnar_invoices(csv_name: str, field_names: List[str], logo_mapping: Dict[str, str]) -> List[Invoice]:
+    columns = HEADER_COLUMNS + [column for slot in CHARGE_KEYS for column in slot]
+    frame = pd.read_csv(csv_name, header=None, names=field_names, skiprows=1, usecols=columns,
+                        dtype=str, keep_default_na=False).fillna('')
+    if frame.empty:
+        return []
+
+    codes, _ = pd.factorize(frame['FULL_NAME'], sort=False)
+    _, first_rows = np.unique(codes, return_index=True)
+
+    base_charges = _to_cents(frame['BASE CHARGE AMOUNT'].to_numpy(dtype=object))
+    # Integer cents, so the grouped sum is exact and order does not matter
+    total_base_charges = pd.Series(base_charges).groupby(codes).sum().to_numpy()
+
+    airbills = frame['AIRBILL #']
+    first_airbill = (airbills != '') & ~pd.DataFrame({'code': codes, 'airbill': airbills}).duplicated()
+    unique_airbills = first_airbill.groupby(codes).sum().to_numpy()
+    item_names = np.where(first_airbill, 'Airbill: ' + airbills, 'Other Charges')
+
+    rows, types, amounts = _melt(frame, CHARGE_KEYS)
+    order = np.argsort(codes[rows], kind='stable')
+    line_codes = codes[rows][order]
+    line_costs = amounts[order].tolist()
+    line_types = types[order].tolist()
+    line_labels = item_names[rows][order].tolist()
+    boundaries = np.searchsorted(line_codes, np.arange(len(first_rows) + 1))
+
+    header = frame.iloc[first_rows].to_dict('records')
+    invoices = []
+    for code, first_row in enumerate(header):
+        start, end = boundaries[code], boundaries[code + 1]
+        items = [LineItem(label, cost, charge_type)
+                 for label, charge_type, cost in zip(line_labels[start:end], line_types[start:end],
+                                                     line_costs[start:end])]
+        items += summary_items(int(total_base_charges[code]), int(unique_airbills[code]))
+        invoices.append(invoice_from_row(first_row, logo_mapping, items))
+    return invoices
@@ -1,105 +1,39 @@
-import requests
-from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+from concurrent.futures import wait, FIRST_COMPLETED
 import os
 import csv
+import tempfile
+import zlib
+from functools import partial
 import typer
-from datetime import datetime
-
-@dataclass
-class Invoice:
-    from_who: str
-    to_who: str
-    logo: str
-    number: str
-    date: str
-    due_date: str
-    items: List[dict]
-    notes: str
+from enum import Enum
+
+from logo_cache import LogoCache
+from manifest import RunManifest, invoice_hash
+from render_cache import RenderCache
+from snapshot import EMPTY, Snapshot, load_snapshot, snapshot_path, source_identity, write_snapshot
+from incremental import IncrementalIngest
+from instrumentation import Instrumentation, timed_call
+from models import CHARGE_KEYS, FIELD_NAMES, Invoice, InvoiceBuilder
+from normalizer import NormalizeReport, iter_normalized, normalize_file, normalized_path
+from renderers import (InvoiceGeneratorRenderer, RenderBackend, RenderError, Renderer,
+                       create_renderer)
+
+class ParseMode(str, Enum):
+    memory = "memory"
+    sorted = "sorted"
+    spill = "spill"
+    columnar = "columnar"
 
 class CSVParser:
-    def __init__(self, csv_name: str, logo_url: str) -> None:
-        self.field_names = [
-            "INVOICE #",
-            "INVOICE DATE",
-            "AIRBILL #",
-            "BILL OF LADING",
-            "SHIPPER ACCOUNT #",
-            "SHIPPER ACCOUNT NAME",
-            "SHIPPER ATTENTION",
-            "SHIPPER ADDRESS 1",
-            "SHIPPER ADDRESS 2",
-            "SHIPPER CITY",
-            "SHIPPER STATE",
-            "SHIPPER ZIP CODE",
-            "SHIPPER REFERENCE",
-            "CONSIGNEE NAME",
-            "CONSIGNEE ATTENTION",
-            "CONSIGNEE ADDRESS 1",
-            "CONSIGNEE ADDRESS 2",
-            "CONSIGNEE CITY",
-            "CONSIGNEE STATE",
-            "CONSIGNEE ZIP CODE",
-            "CONSIGNEE COUNTRY CODE",
-            "THIRD PARTY ACCOUNT #",
-            "THIRD PARTY ACCOUNT NAME",
-            "THIRD PARTY ADDRESS",
-            "THIRD PARTY ADDRESS.1",
-            "THIRD PARTY CITY",
-            "THIRD PARTY STATE",
-            "THIRD PARTY ZIP CODE",
-            "SHIPMENT DATE",
-            "PO #",
-            "CUST INV #",
-            "DEPT #",
-            "PRODUCT CODE",
-            "ZONE",
-            "BILLED WEIGHT",
-            "ACTUAL WEIGHT",
-            "DIMENSIONAL WEIGHT",
-            "PIECES",
-            "DIMENSIONS",
-            "BASE CHARGE TYPE",
-            "SHIPMENT TOTAL",
-            "BASE CHARGE AMOUNT",
-            "CHARGE 1 TYPE",
-            "CHARGE 1 AMT",
-            "CHARGE 2 TYPE",
-            "CHARGE 2 AMT",
-            "CHARGE 3 TYPE",
-            "CHARGE 3 AMT",
-            "CHARGE 4 TYPE",
-            "CHARGE 4 AMT",
-            "CHARGE 5 TYPE",
-            "CHARGE 5 AMT",
-            "CHARGE 6 TYPE",
-            "CHARGE 6 AMT",
-            "CHARGE 7 TYPE",
-            "CHARGE 7 AMT",
-            "CHARGE 8 TYPE",
-            "CHARGE 8 AMT",
-            "CREDIT 1 DESCRIPTION",
-            "CREDIT 1 AMT",
-            "CREDIT 2 DESCRIPTION",
-            "CREDIT 2 AMT",
-            "CREDIT 3 DESCRIPTION",
-            "CREDIT 3 AMT",
-            "REFERENCE 2",
-            "REFERENCE 3",
-            "REFERENCE 4",
-            "REFERENCE 5",
-            "CUSTOMERID",
-            "SCAC",
-            "CLASS",
-            "CHARGENOTES",
-            "RECEIVEDBY",
-            "RECEIVEDATE",
-            "FULL_NAME",
-            "EMAIL",
-            "DATABASE_NAME"
-        ]
+    def __init__(self, csv_name: str, logo_url: str, instrumentation: Instrumentation = None,
+                 normalize: bool = False) -> None:
+        self.field_names = list(FIELD_NAMES)
         self.csv_name = csv_name
+        self.normalize = normalize
+        self.report = NormalizeReport()
         self.logo_url = logo_url
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
 
         self.logo_mapping = {
             "esurex": 'https://esurex.com/App_Themes/Standard/images/logo-footer.png',
@@ -109,131 +43,370 @@ class CSVParser:
             "default": 'https://www.safetysign.com/images/source/large-images/F4760.png'
         }
 
-    def get_array_of_invoices(self) -> List[Invoice]:
+    # Rows as lists of values; with normalize set they are repaired on the fly, filling self.report as they go
+    def read_records(self) -> Iterator[List[str]]:
+        if self.normalize:
+            yield from iter_normalized(self.csv_name, self.field_names, self.report)
+            return
+        with open(self.csv_name, 'r') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            yield from reader
+
+    def _read_rows(self) -> Iterator[dict]:
+        if self.normalize:
+            rows = (dict(zip(self.field_names, values)) for values in self.read_records())
+            yield from self.instrumentation.timed(rows, 'csv_parse')
+            return
         with open(self.csv_name, 'r') as f:
             reader = csv.DictReader(f, self.field_names)
-            invoices_by_user = {}
-            header_skipped = False
-
-            for row in reader:
-                if not header_skipped:
-                    header_skipped = True
-                    continue
-
-                full_name = row['FULL_NAME']
-                if full_name not in invoices_by_user:
-                    invoices_by_user[full_name] = []
-
-                invoices_by_user[full_name].append(row)
-
-            current_csv = []
-            for full_name, rows in invoices_by_user.items():
-                total_base_charge = 0
-                items = []
-                processed_airbills = set()
-
-                for row in rows:
-                    base_charge = float(row['BASE CHARGE AMOUNT']) if row['BASE CHARGE AMOUNT'] else 0
-                    total_base_charge += base_charge
-
-                    airbill_number = row['AIRBILL #']
-                    if airbill_number and airbill_number not in processed_airbills:
-                        processed_airbills.add(airbill_number)
-                        item_name = f"Airbill: {airbill_number}"
-                    else:
-                        item_name = "Other Charges"
-
-                    for i in range(1, 9):
-                        charge_type_key = f"CHARGE {i} TYPE"
-                        charge_amt_key = f"CHARGE {i} AMT"
-                        charge_type = row[charge_type_key]
-                        charge_amt = row[charge_amt_key]
-
-                        if charge_type and charge_amt:
-                            charge_amt_float = float(charge_amt)
-                            items.append({
-                                'name': f"{item_name} - {charge_type}",
-                                'quantity': 1,
-                                'unit_cost': charge_amt_float
-                            })
-
-                if total_base_charge > 0:
-                    items.append({
-                        'name': 'Total Base Charge Amount',
-                        'quantity': 1,
-                        'unit_cost': total_base_charge
-                    })
-
-                num_unique_airbills = len(processed_airbills)
-                reporting_fee = 2.5 * num_unique_airbills
-                items.append({
-                    'name': 'Reporting fee',
-                    'quantity': 1,
-                    'unit_cost': reporting_fee
-                })
-
-                items.append({
-                    'name': 'Insured Value',
-                    'quantity': 1,
-                    'unit_cost': 0.00
-                })
-
-                invoice_obj = Invoice(
-                    from_who=f"{rows[0]['FULL_NAME']} \n Email:{rows[0]['EMAIL']}, \n Service:{rows[0]['SCAC']}",
-                    to_who=f"{rows[0]['CONSIGNEE ATTENTION']}\n{rows[0]['CONSIGNEE ADDRESS 1']}\n{rows[0]['CONSIGNEE ADDRESS 2']}",
-                    logo=self.logo_mapping.get(rows[0]['DATABASE_NAME'].lower(), self.logo_mapping['default']),
-                    number=rows[0]['DATABASE_NAME'],
-                    date=rows[0]['INVOICE DATE'],
-                    due_date='',
-                    items=items,
-                    notes=''
-                )
-                current_csv.append(invoice_obj)
-
-        return current_csv
+            next(reader, None)
+            yield from self.instrumentation.timed(reader, 'csv_parse')
+
+    def get_array_of_invoices(self) -> List[Invoice]:
+        return self.aggregate(self._read_rows())
+
+    def aggregate(self, rows: Iterable[dict]) -> List[Invoice]:
+        invoices_by_user = {}
+        for row in rows:
+            full_name = row['FULL_NAME']
+            if full_name not in invoices_by_user:
+                invoices_by_user[full_name] = InvoiceBuilder(self.logo_mapping)
+            invoices_by_user[full_name].add_row(row)
+
+        return [builder.build() for builder in invoices_by_user.values()]
+
+    def aggregate_snapshot(self, snapshot: Snapshot) -> List[Invoice]:
+        full_names = snapshot.codes('FULL_NAME')
+        airbill_codes, airbills = snapshot.codes('AIRBILL #'), snapshot.values('AIRBILL #')
+        base_charges = snapshot.cents('BASE CHARGE AMOUNT')
+        slots = [(snapshot.codes(charge_type_key), snapshot.values(charge_type_key), snapshot.cents(charge_amt_key))
+                 for charge_type_key, charge_amt_key in CHARGE_KEYS]
+
+        # FULL_NAME codes are numbered in order of first appearance, matching the insertion order of aggregate()
+        builders = {}
+        for index in range(snapshot.rows):
+            builder = builders.get(full_names[index])
+            row = None
+            if builder is None:
+                builder = builders[full_names[index]] = InvoiceBuilder(self.logo_mapping)
+                row = snapshot.row(index)
+            charges = [(type_values[type_codes[index]], amounts[index])
+                       for type_codes, type_values, amounts in slots
+                       if amounts[index] != EMPTY and type_values[type_codes[index]]]
+            base_charge = base_charges[index]
+            builder.add_parsed(row, base_charge if base_charge != EMPTY else 0, airbills[airbill_codes[index]],
+                               charges)
+        return [builder.build() for builder in builders.values()]
+
+    def iter_invoices(self, mode: ParseMode = ParseMode.memory, partitions: int = 64,
+                      snapshot: Snapshot = None) -> Iterator[Invoice]:
+        if mode == ParseMode.sorted:
+            return self._iter_sorted_invoices(self._read_rows())
+        if mode == ParseMode.spill:
+            return self._iter_spilled_invoices(partitions)
+        if mode == ParseMode.columnar:
+            from aggregation import columnar_invoices
+            return self._iter_when_started(partial(columnar_invoices, self.csv_name, self.field_names,
+                                                   self.logo_mapping))
+        if snapshot is not None:
+            return self._iter_when_started(partial(self.aggregate_snapshot, snapshot))
+        return self._iter_when_started(self.get_array_of_invoices)
+
+    # Defers the whole-file modes to the first next() like the streaming modes, so timing wrappers see the work
+    def _iter_when_started(self, build) -> Iterator[Invoice]:
+        yield from build()
+
+    def _iter_sorted_invoices(self, rows: Iterable[dict]) -> Iterator[Invoice]:
+        flushed = set()
+        builder = None
+        current_name = None
+        for row in rows:
+            full_name = row['FULL_NAME']
+            if builder is None or full_name != current_name:
+                if builder is not None:
+                    flushed.add(current_name)
+                    yield builder.build()
+                if full_name in flushed:
+                    raise ValueError(f"{self.csv_name} is not sorted by FULL_NAME ({full_name!r} appears again), "
+                                     f"use the spill parse mode instead")
+                builder = InvoiceBuilder(self.logo_mapping)
+                current_name = full_name
+            builder.add_row(row)
+        if builder is not None:
+            yield builder.build()
+
+    def _iter_spilled_invoices(self, partitions: int) -> Iterator[Invoice]:
+        # Rows are spilled to disk partitioned by customer, so only one partition's customers are in memory at a time
+        with tempfile.TemporaryDirectory(prefix='invoices_spill_') as spill_directory:
+            paths = [os.path.join(spill_directory, f"{i}.csv") for i in range(partitions)]
+            files = [open(path, 'w', newline='') for path in paths]
+            try:
+                writers = [csv.writer(f) for f in files]
+                for row in self._read_rows():
+                    partition = zlib.crc32(str(row['FULL_NAME']).encode()) % partitions
+                    writers[partition].writerow([row[name] for name in self.field_names])
+            finally:
+                for f in files:
+                    f.close()
+
+            for path in paths:
+                invoices_by_user = {}
+                with open(path, 'r', newline='') as f:
+                    for row in csv.DictReader(f, self.field_names):
+                        full_name = row['FULL_NAME']
+                        if full_name not in invoices_by_user:
+                            invoices_by_user[full_name] = InvoiceBuilder(self.logo_mapping)
+                        invoices_by_user[full_name].add_row(row)
+                for builder in invoices_by_user.values():
+                    yield builder.build()
 
 class ApiConnector:
-    def __init__(self, output_directory: str) -> None:
-        self.headers = {"Content-Type": "application/json"}
-        self.url = 'https://invoice-generator.com'
+    def __init__(self, output_directory: str, renderer: Renderer = None, concurrency: int = 1,
+                 manifest: RunManifest = None, render_cache: RenderCache = None,
+                 instrumentation: Instrumentation = None) -> None:
         self.output_directory = output_directory
+        self.concurrency = max(1, concurrency)
+        self.renderer = renderer if renderer is not None else InvoiceGeneratorRenderer(pool_size=self.concurrency)
+        self.manifest = manifest
+        self.render_cache = render_cache
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        self.skipped = 0
+        self.failed = 0
+
+    def invoice_path(self, invoice: Invoice, content_hash: str) -> str:
+        # Named after the content so a re-run overwrites the same file instead of adding a duplicate
+        return os.path.join(self.output_directory, f"{invoice.number}_{content_hash[:16]}_invoice.pdf")
+
+    def save_invoice_pdf(self, invoice: Invoice, pdf: bytes, content_hash: str, render_seconds: float) -> None:
+        invoice_path = self.invoice_path(invoice, content_hash)
+        typer.echo(f"Generate invoice for {os.path.basename(invoice_path)}")
+        # Written under a temporary name and renamed, so an interrupted run never leaves a truncated PDF
+        fd, temporary_path = tempfile.mkstemp(dir=self.output_directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        os.replace(temporary_path, invoice_path)
+        self.instrumentation.record_render(invoice.number, render_seconds, len(pdf))
+        if self.render_cache is not None:
+            key = self.render_cache.key(self.renderer.cache_identity(), content_hash)
+            self.render_cache.store_file(key, invoice_path)
+        if self.manifest is not None:
+            self.manifest.record(content_hash, invoice.number, 'done', invoice_path)
+        typer.echo("File Saved")
+
+    def _reuse_cached_render(self, invoice: Invoice, content_hash: str) -> bool:
+        invoice_path = self.invoice_path(invoice, content_hash)
+        if not self.render_cache.copy_to(self.render_cache.key(self.renderer.cache_identity(), content_hash), invoice_path):
+            return False
+        typer.echo(f"Reused cached render for {os.path.basename(invoice_path)}")
+        self.instrumentation.count('render_cache_hits')
+        if self.manifest is not None:
+            self.manifest.record(content_hash, invoice.number, 'done', invoice_path)
+        return True
+
+    def _render_failed(self, invoice: Invoice, content_hash: str, error: RenderError) -> None:
+        self.failed += 1
+        self.instrumentation.count('failures')
+        typer.echo(f"Fail: {error}")
+        if self.manifest is not None:
+            self.manifest.record(content_hash, invoice.number, 'failed', error=str(error))
+
+    def _pending_invoices(self, invoices: Iterable[Invoice]) -> Iterator[Tuple[Invoice, str]]:
+        for invoice in invoices:
+            content_hash = invoice_hash(invoice)
+            if self.manifest is not None and self.manifest.is_done(content_hash):
+                self.skipped += 1
+                self.instrumentation.count('skipped')
+                continue
+            if self.render_cache is not None and self._reuse_cached_render(invoice, content_hash):
+                continue
+            yield invoice, content_hash
+
+    def _render_and_save(self, invoice: Invoice, content_hash: str) -> None:
+        try:
+            pdf, seconds = timed_call(self.renderer.render, invoice)
+        except RenderError as e:
+            self._render_failed(invoice, content_hash, e)
+            return
+        self.save_invoice_pdf(invoice, pdf, content_hash, seconds)
 
     def connect_to_api_and_save_invoice_pdf(self, invoice: Invoice) -> None:
-        invoice_parsed = {
-            'from': invoice.from_who,
-            'to': invoice.to_who,
-            'logo': invoice.logo,
-            'number': invoice.number,
-            'date': invoice.date,
-            'due_date': invoice.due_date,
-            'items': invoice.items,
-            'notes': invoice.notes
-        }
-        r = requests.post(self.url, json=invoice_parsed, headers=self.headers)
-        if r.status_code == 200 or r.status_code == 201:
-            pdf = r.content
-            current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-            invoice_name = f"{invoice.number}_{current_time}_invoice.pdf"
-            invoice_path = os.path.join(self.output_directory, invoice_name)
-            with open(invoice_path, 'wb') as f:
-                typer.echo(f"Generate invoice for {invoice_name}")
-                f.write(pdf)
-            typer.echo("File Saved")
-        else:
-            typer.echo(f"Fail: {r.text}")
-
-def main(csv_name: str = typer.Argument('tu_output.csv')):
-    output_directory = 'D:\GitHub\Freelancer\InvoicesGenerator\invoices'
+        self._render_and_save(invoice, invoice_hash(invoice))
+
+    def _collect(self, future, invoice: Invoice, content_hash: str) -> None:
+        try:
+            pdf, seconds = future.result()
+        except RenderError as e:
+            self._render_failed(invoice, content_hash, e)
+            return
+        self.save_invoice_pdf(invoice, pdf, content_hash, seconds)
+
+    def save_invoices(self, invoices: Iterable[Invoice]) -> None:
+        if self.concurrency == 1:
+            for invoice, content_hash in self._pending_invoices(invoices):
+                self._render_and_save(invoice, content_hash)
+            return
+
+        # Keep a bounded number of invoices in flight so a lazy iterable is never drained up front
+        render = partial(timed_call, self.renderer.render_task())
+        with self.renderer.executor(self.concurrency) as executor:
+            pending = {}
+            for invoice, content_hash in self._pending_invoices(invoices):
+                if len(pending) >= 2 * self.concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(future, *pending.pop(future))
+                pending[executor.submit(render, invoice)] = (invoice, content_hash)
+            for future, (invoice, content_hash) in pending.items():
+                self._collect(future, invoice, content_hash)
+
+# The path from a carrier file to lazily built invoices: snapshot, in-stream or on-disk normalization, then parsing
+def open_invoices(csv_reader: CSVParser, parse_mode: ParseMode, normalize: bool, use_snapshot: bool,
+                  instrumentation: Instrumentation) -> Tuple[Iterator[Invoice], Optional[Snapshot],
+                                                             Optional[NormalizeReport]]:
+    csv_name = csv_reader.csv_name
+    snapshot = None
+    streamed_report = None
+    use_snapshot = use_snapshot and parse_mode == ParseMode.memory
+    if use_snapshot:
+        with instrumentation.span('snapshot_load'):
+            snapshot = load_snapshot(csv_name, normalize)
+    if snapshot is not None:
+        typer.echo(f"Using {snapshot.path}, {snapshot.rows} rows parsed earlier")
+        if snapshot.report:
+            typer.echo(snapshot.report)
+    elif normalize and parse_mode == ParseMode.columnar:
+        # pandas reads from a file, so this is the one mode that writes the normalized rows out first
+        csv_reader.csv_name = normalized_path(csv_name)
+        with instrumentation.span('normalize'):
+            report = normalize_file(csv_name, csv_reader.csv_name, csv_reader.field_names)
+        echo_report(report, instrumentation)
+    else:
+        # Everywhere else rows are normalized as the parser reads them, so streaming modes render right away
+        csv_reader.normalize = normalize
+        if use_snapshot:
+            try:
+                with instrumentation.span('snapshot_write'):
+                    write_snapshot(csv_reader.read_records(), csv_reader.field_names, snapshot_path(csv_name),
+                                   source_identity(csv_name), normalize, csv_reader.report if normalize else None)
+            except OSError as e:
+                # A read-only input directory only costs the speed-up, the rows are parsed from the CSV instead
+                typer.echo(f"Could not write the snapshot, parsing {csv_name} directly: {e}")
+                use_snapshot = False
+                csv_reader.report = NormalizeReport()
+            else:
+                snapshot = load_snapshot(csv_name, normalize)
+                if normalize:
+                    echo_report(csv_reader.report, instrumentation)
+        if normalize and not use_snapshot:
+            streamed_report = csv_reader.report
+    invoices = instrumentation.timed(csv_reader.iter_invoices(parse_mode, snapshot=snapshot), 'parse_and_aggregate')
+    return invoices, snapshot, streamed_report
+
+def echo_report(report: NormalizeReport, instrumentation: Instrumentation) -> None:
+    instrumentation.count('rejected_rows', report.rejected)
+    typer.echo(report.summary())
+    for bad_row in report.examples:
+        typer.echo(f"  line {bad_row.line_number}: {bad_row.reason}")
+
+def add_aggregation_span(instrumentation: Instrumentation) -> None:
+    # Rows are parsed lazily while invoices are built, so aggregation is what remains of the combined stage
+    spans = instrumentation.span_seconds
+    if 'parse_and_aggregate' in spans:
+        instrumentation.add_span('aggregation', max(0.0, spans['parse_and_aggregate'] - spans.get('csv_parse', 0.0)))
+
+def main(csv_name: str = typer.Argument('tu_output.csv'),
+         output_directory: str = typer.Option('invoices', help="Where the PDFs and the run manifest are written"),
+         concurrency: int = typer.Option(1, help="Number of invoices rendered at the same time"),
+         backend: RenderBackend = typer.Option(RenderBackend.api, help="api: invoice-generator.com, "
+                                               "local: render PDFs in-process across a process pool"),
+         api_url: str = typer.Option('https://invoice-generator.com', help="Invoice render endpoint"),
+         max_retries: int = typer.Option(3, help="Retries per invoice on HTTP 429/5xx or connection errors"),
+         logo_cache_directory: str = typer.Option('logo_cache', help="Where downloaded logos are kept"),
+         use_logo_cache: bool = typer.Option(True, "--logo-cache/--no-logo-cache",
+                                             help="Fetch each logo once and inline it instead of sending its URL"),
+         resume: bool = typer.Option(True, help="Skip invoices the run manifest already lists as rendered"),
+         render_cache_directory: str = typer.Option('render_cache', help="Where rendered PDFs are kept for reuse"),
+         render_cache_size_mb: int = typer.Option(1024, help="Size limit of the render cache, least recently "
+                                                  "used PDFs are evicted first"),
+         use_render_cache: bool = typer.Option(True, "--render-cache/--no-render-cache",
+                                               help="Reuse PDFs of invoices whose content did not change"),
+         normalize: bool = typer.Option(True, help="Unwrap quoted rows, repair column counts and reject rows "
+                                                   "with non-numeric amounts before parsing"),
+         parse_mode: ParseMode = typer.Option(ParseMode.memory, help="memory: group all rows first, "
+                                              "sorted: stream input pre-sorted by FULL_NAME, "
+                                              "spill: stream unsorted input through on-disk partitions, "
+                                              "columnar: aggregate with pandas (needs pandas)"),
+         metrics: bool = typer.Option(True, help="Write per-stage timings and render latencies to "
+                                                 "invoice_generator.log as JSON lines"),
+         use_snapshot: bool = typer.Option(True, "--snapshot/--no-snapshot",
+                                           help="With --parse-mode memory, keep the parsed columns in "
+                                                "<file>.snapshot and reuse them while the CSV is unchanged"),
+         incremental: bool = typer.Option(False, help="Parse only the rows appended since the last --incremental "
+                                                      "run of this file and render only the customers they touch"),
+         final: bool = typer.Option(False, help="With --incremental, take the end of the file as the end of its last "
+                                                "row, for a finished export without a trailing line break")):
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
     logo_url = 'https://www.safetysign.com/images/source/large-images/F4760.png'
     typer.echo(f"Running script with - {csv_name}")
-    csv_reader = CSVParser(csv_name, logo_url)
-    array_of_invoices = csv_reader.get_array_of_invoices()
-    api = ApiConnector(output_directory)
-    for invoice in array_of_invoices:
-        api.connect_to_api_and_save_invoice_pdf(invoice)
+    instrumentation = Instrumentation(enabled=metrics)
+    csv_reader = CSVParser(csv_name, logo_url, instrumentation)
+    ingest = None
+    snapshot = None
+    streamed_report = None
+    if incremental:
+        ingest = IncrementalIngest(csv_name, csv_reader.field_names, csv_reader.logo_mapping, normalize)
+        with instrumentation.span('incremental_parse'):
+            array_of_invoices = ingest.update(final)
+        typer.echo(ingest.summary())
+        echo_report(ingest.report, instrumentation)
+    else:
+        array_of_invoices, snapshot, streamed_report = open_invoices(csv_reader, parse_mode, normalize,
+                                                                     use_snapshot, instrumentation)
+    logo_cache = None
+    if use_logo_cache:
+        logo_cache = LogoCache(logo_cache_directory)
+        with instrumentation.span('logo_preload'):
+            logo_cache.preload(csv_reader.logo_mapping.values(), decode=backend == RenderBackend.local)
+    renderer = create_renderer(backend, api_url, concurrency, max_retries, logo_cache, instrumentation)
+    manifest = RunManifest(os.path.join(output_directory, 'manifest.jsonl'))
+    if not resume:
+        manifest.records.clear()
+    render_cache = None
+    if use_render_cache:
+        render_cache = RenderCache(render_cache_directory, render_cache_size_mb * 1024 * 1024)
+    api = ApiConnector(output_directory, renderer, concurrency, manifest, render_cache, instrumentation)
+    try:
+        with instrumentation.span('pipeline'):
+            api.save_invoices(array_of_invoices)
+    except ValueError as e:
+        # Raised while parsing, e.g. --parse-mode sorted on a file that is not sorted
+        typer.echo(f"{e}; the invoices rendered so far are in the manifest and a rerun skips them")
+        raise typer.Exit(1)
+    finally:
+        manifest.close()
+        if snapshot is not None:
+            snapshot.close()
+    if streamed_report is not None:
+        echo_report(streamed_report, instrumentation)
+    typer.echo(f"Skipped {api.skipped} invoices already rendered, {api.failed} failed")
+    if ingest is not None:
+        superseded = ingest.commit(array_of_invoices, [invoice_hash(invoice) for invoice in array_of_invoices],
+                                   manifest.is_done, api.invoice_path)
+        ingest.close()
+        typer.echo(f"Checkpoint saved to {ingest.path}, {superseded} outdated invoices removed")
+    if render_cache is not None:
+        typer.echo(render_cache.stats())
+
+    if metrics:
+        add_aggregation_span(instrumentation)
+        summary = instrumentation.close()
+        latency = summary['render_latency']
+        typer.echo(f"Rendered {summary['counters'].get('rendered', 0)} invoices in {summary['wall_seconds']}s, "
+                   f"render latency p50 {latency['p50']}s p95 {latency['p95']}s p99 {latency['p99']}s")
+        typer.echo("Stages: " + ", ".join(f"{name} {seconds}s" for name, seconds in summary['spans'].items()))
 
 if __name__ == "__main__":
     typer.run(main)
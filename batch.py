@@ -0,0 +1,216 @@
+import contextlib
+import glob
+import io
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Dict, List, Optional, Tuple
+
+import typer
+
+from automate import ApiConnector, CSVParser, ParseMode
+from instrumentation import Instrumentation
+from logo_cache import LogoCache
+from manifest import RunManifest
+from models import FIELD_NAMES, Invoice
+from normalizer import normalize_file, normalized_path
+from render_cache import RenderCache
+from renderers import RenderBackend, create_renderer
+
+LOGO_URL = 'https://www.safetysign.com/images/source/large-images/F4760.png'
+
+
+@dataclass
+class RenderSettings:
+    output_directory: str
+    backend: RenderBackend
+    api_url: str
+    concurrency: int
+    max_retries: int
+    logo_cache_directory: Optional[str]
+    logo_paths: Dict[str, str]
+    render_cache_directory: Optional[str]
+    render_cache_bytes: int
+    resume: bool
+    metrics: bool
+    run_id: str
+
+
+@dataclass
+class ChunkResult:
+    tenant: str
+    invoices: int
+    skipped: int
+    failed: int
+    render_latencies: List[float]
+    counters: Dict[str, int]
+
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    paths = []
+    for source in inputs:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, '*.csv'))
+        else:
+            matches = glob.glob(source) or [source]
+        for path in sorted(matches):
+            # Leave out what earlier runs wrote next to the inputs
+            if path.endswith('.normalized.csv') or path.endswith('.rejects.csv'):
+                continue
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def parse_file(csv_name: str, normalize: bool, parse_mode: ParseMode) -> Tuple[str, str, Dict[str, List[Invoice]]]:
+    parser = CSVParser(csv_name, LOGO_URL)
+    report = parser.report
+    if normalize and parse_mode == ParseMode.columnar:
+        # pandas reads from a file; the other modes normalize rows as they parse them
+        parser.csv_name = normalized_path(csv_name)
+        report = normalize_file(csv_name, parser.csv_name, FIELD_NAMES)
+    else:
+        parser.normalize = normalize
+    by_tenant: Dict[str, List[Invoice]] = defaultdict(list)
+    for invoice in parser.iter_invoices(parse_mode):
+        # invoice.number carries DATABASE_NAME
+        by_tenant[invoice.number or 'unknown'].append(invoice)
+    return csv_name, report.summary() if normalize else '', dict(by_tenant)
+
+
+# State each render worker builds once and reuses for every chunk it is handed
+_settings: Optional[RenderSettings] = None
+_renderer = None
+_instrumentation: Optional[Instrumentation] = None
+_render_cache: Optional[RenderCache] = None
+_manifests: Dict[str, RunManifest] = {}
+
+
+def _init_render_worker(settings: RenderSettings) -> None:
+    global _settings, _renderer, _instrumentation, _render_cache
+    _settings = settings
+    logo_cache = None
+    if settings.logo_cache_directory is not None:
+        logo_cache = LogoCache(settings.logo_cache_directory)
+        logo_cache.seed(settings.logo_paths)
+        if settings.backend == RenderBackend.local:
+            logo_cache.preload(settings.logo_paths, decode=True)
+    _instrumentation = Instrumentation(enabled=settings.metrics, run_id=settings.run_id)
+    # Each worker is one of the processes doing the rendering, so a local renderer runs in-process
+    _renderer = create_renderer(settings.backend, settings.api_url, settings.concurrency, settings.max_retries,
+                                logo_cache, _instrumentation)
+    if settings.render_cache_directory is not None:
+        _render_cache = RenderCache(settings.render_cache_directory, settings.render_cache_bytes)
+
+
+def _tenant_manifest(tenant: str, output_directory: str) -> RunManifest:
+    if tenant not in _manifests:
+        _manifests[tenant] = RunManifest(os.path.join(output_directory, 'manifest.jsonl'))
+        if not _settings.resume:
+            _manifests[tenant].records.clear()
+    return _manifests[tenant]
+
+
+def render_chunk(tenant: str, invoices: List[Invoice]) -> ChunkResult:
+    output_directory = os.path.join(_settings.output_directory, tenant)
+    concurrency = _settings.concurrency if _settings.backend == RenderBackend.api else 1
+    api = ApiConnector(output_directory, _renderer, concurrency, _tenant_manifest(tenant, output_directory),
+                       _render_cache, _instrumentation)
+    # Per-invoice lines from many workers would interleave; the parent reports progress per tenant
+    with contextlib.redirect_stdout(io.StringIO()):
+        api.save_invoices(invoices)
+    latencies, counters = _instrumentation.drain()
+    return ChunkResult(tenant, len(invoices), api.skipped, api.failed, latencies, counters)
+
+
+def interleave_chunks(by_tenant: Dict[str, List[Invoice]], chunk_size: int) -> List[Tuple[str, List[Invoice]]]:
+    # Round-robin over tenants so a small tenant is not queued behind every chunk of a large one
+    chunks = [[(tenant, invoices[i:i + chunk_size]) for i in range(0, len(invoices), chunk_size)]
+              for tenant, invoices in by_tenant.items()]
+    return [chunk for group in zip_longest(*chunks) for chunk in group if chunk is not None]
+
+
+def main(inputs: List[str] = typer.Argument(..., help="Carrier CSV files, directories of CSV files or glob patterns"),
+         output_directory: str = typer.Option('invoices', help="Each tenant gets its own subdirectory here"),
+         processes: int = typer.Option(os.cpu_count() or 1, help="Worker processes for parsing and rendering"),
+         chunk_size: int = typer.Option(50, help="Invoices handed to a worker at a time"),
+         concurrency: int = typer.Option(4, help="Invoices each worker renders at the same time with --backend api"),
+         backend: RenderBackend = typer.Option(RenderBackend.api, help="api: invoice-generator.com, "
+                                               "local: render PDFs in the worker processes"),
+         api_url: str = typer.Option('https://invoice-generator.com', help="Invoice render endpoint"),
+         max_retries: int = typer.Option(3, help="Retries per invoice on HTTP 429/5xx or connection errors"),
+         logo_cache_directory: str = typer.Option('logo_cache', help="Where downloaded logos are kept"),
+         use_logo_cache: bool = typer.Option(True, "--logo-cache/--no-logo-cache",
+                                             help="Fetch each logo once and inline it instead of sending its URL"),
+         resume: bool = typer.Option(True, help="Skip invoices the tenant manifests already list as rendered"),
+         render_cache_directory: str = typer.Option('render_cache', help="Where rendered PDFs are kept for reuse"),
+         render_cache_size_mb: int = typer.Option(1024, help="Size limit of the render cache"),
+         use_render_cache: bool = typer.Option(True, "--render-cache/--no-render-cache",
+                                               help="Reuse PDFs of invoices whose content did not change"),
+         normalize: bool = typer.Option(True, help="Normalize each file before parsing"),
+         parse_mode: ParseMode = typer.Option(ParseMode.memory, help="How each file is parsed, see automate.py"),
+         metrics: bool = typer.Option(True, help="Write per-stage timings and render latencies to "
+                                                 "invoice_generator.log as JSON lines")):
+    csv_names = expand_inputs(inputs)
+    if not csv_names:
+        typer.echo("No CSV files matched")
+        raise typer.Exit(1)
+    processes = max(1, processes)
+    instrumentation = Instrumentation(enabled=metrics)
+
+    # Customers are grouped per file, as automate.py does, and only then split by tenant
+    by_tenant: Dict[str, List[Invoice]] = defaultdict(list)
+    with instrumentation.span('parse_files', files=len(csv_names)):
+        with ProcessPoolExecutor(min(processes, len(csv_names))) as executor:
+            futures = [executor.submit(parse_file, csv_name, normalize, parse_mode) for csv_name in csv_names]
+            for future in as_completed(futures):
+                csv_name, summary, invoices = future.result()
+                typer.echo(f"{csv_name}: {sum(map(len, invoices.values()))} invoices. {summary}".rstrip())
+                for tenant, tenant_invoices in invoices.items():
+                    by_tenant[tenant].extend(tenant_invoices)
+
+    logo_paths: Dict[str, str] = {}
+    if use_logo_cache:
+        logo_cache = LogoCache(logo_cache_directory)
+        with instrumentation.span('logo_preload'):
+            logo_cache.preload(CSVParser('', LOGO_URL).logo_mapping.values())
+        logo_paths = logo_cache.resolved_paths()
+
+    for tenant in by_tenant:
+        os.makedirs(os.path.join(output_directory, tenant), exist_ok=True)
+    settings = RenderSettings(output_directory, backend, api_url, concurrency, max_retries,
+                              logo_cache_directory if use_logo_cache else None, logo_paths,
+                              render_cache_directory if use_render_cache else None,
+                              render_cache_size_mb * 1024 * 1024, resume, metrics, instrumentation.run_id)
+
+    totals = {tenant: len(invoices) for tenant, invoices in by_tenant.items()}
+    done: Dict[str, int] = defaultdict(int)
+    skipped: Dict[str, int] = defaultdict(int)
+    failed: Dict[str, int] = defaultdict(int)
+    with instrumentation.span('render'):
+        with ProcessPoolExecutor(processes, initializer=_init_render_worker, initargs=(settings,)) as executor:
+            futures = [executor.submit(render_chunk, tenant, invoices)
+                       for tenant, invoices in interleave_chunks(by_tenant, max(1, chunk_size))]
+            for future in as_completed(futures):
+                result = future.result()
+                instrumentation.merge(result.render_latencies, result.counters)
+                done[result.tenant] += result.invoices
+                skipped[result.tenant] += result.skipped
+                failed[result.tenant] += result.failed
+                typer.echo(f"[{result.tenant}] {done[result.tenant]}/{totals[result.tenant]} invoices, "
+                           f"{skipped[result.tenant]} skipped, {failed[result.tenant]} failed")
+
+    for tenant in sorted(totals):
+        typer.echo(f"{tenant}: {totals[tenant]} invoices in {os.path.join(output_directory, tenant)}, "
+                   f"{skipped[tenant]} skipped, {failed[tenant]} failed")
+    if metrics:
+        summary = instrumentation.close()
+        latency = summary['render_latency']
+        typer.echo(f"Rendered {summary['counters'].get('rendered', 0)} invoices in {summary['wall_seconds']}s, "
+                   f"render latency p50 {latency['p50']}s p95 {latency['p95']}s p99 {latency['p99']}s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,225 @@
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, List
+
+import typer
+
+from automate import ApiConnector, CSVParser, ParseMode, add_aggregation_span, open_invoices
+from instrumentation import Instrumentation
+from manifest import RunManifest
+from models import FIELD_NAMES
+from render_cache import RenderCache
+from renderers import RenderBackend, create_renderer
+from stub_server import start_stub_server
+
+TENANTS = ['esurex', 'assurem', 'transurit', 'z2b2']
+CHARGE_TYPES = ['Fuel Surcharge', 'Residential Delivery Surcharge', 'Direct Signature Required (Ground Shipments)',
+                'Adult Signature Required (Express Shipments)', 'Additional Handling - Length+Girth',
+                'Peak Surcharge - Additional Handling', 'Delivery Area Surcharge', 'Address Correction']
+
+
+def generate_carrier_file(path: str, rows: int, customers: int, charge_density: float, seed: int = 0,
+                          sorted_by_customer: bool = False) -> List[str]:
+    rng = random.Random(seed)
+    column = {name: i for i, name in enumerate(FIELD_NAMES)}
+    airbills: List[str] = []
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELD_NAMES)
+        for row in range(rows):
+            values = [''] * len(FIELD_NAMES)
+            # --parse-mode sorted needs every row of a customer to be adjacent
+            customer = row * customers // rows if sorted_by_customer else rng.randrange(customers)
+            # Roughly one row in ten repeats an airbill, which the invoices list as "Other Charges"
+            if airbills and rng.random() < 0.1:
+                airbill = rng.choice(airbills)
+            else:
+                airbill = str(rng.randrange(10 ** 11, 10 ** 12))
+                airbills.append(airbill)
+            values[column['INVOICE #']] = '61900008YA05'
+            values[column['INVOICE DATE']] = '01/05/2024'
+            values[column['AIRBILL #']] = airbill
+            values[column['CONSIGNEE ATTENTION']] = f"Consignee {customer}"
+            values[column['CONSIGNEE ADDRESS 1']] = f"{rng.randrange(1, 9999)} Main St"
+            values[column['CONSIGNEE ADDRESS 2']] = rng.choice(['', 'Suite 100'])
+            values[column['SCAC']] = rng.choice(['FDX', 'UPS'])
+            values[column['BASE CHARGE AMOUNT']] = f"{rng.uniform(5, 250):.2f}"
+            for i in range(1, 9):
+                if rng.random() < charge_density:
+                    values[column[f"CHARGE {i} TYPE"]] = rng.choice(CHARGE_TYPES)
+                    values[column[f"CHARGE {i} AMT"]] = f"{rng.uniform(0.5, 40):.2f}"
+                else:
+                    values[column[f"CHARGE {i} AMT"]] = '0.0'
+            values[column['FULL_NAME']] = f"Customer {customer}"
+            values[column['EMAIL']] = f"customer{customer}@example.com"
+            values[column['DATABASE_NAME']] = TENANTS[customer % len(TENANTS)]
+            writer.writerow(values)
+    return airbills
+
+
+def create_user_databases(directory: str, tracking_numbers: List[str], seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    connections_info = []
+    for tenant in TENANTS:
+        path = os.path.join(directory, f"{tenant}.sqlite")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE [USER] (USER_ID INTEGER, FULL_NAME TEXT, EMAIL TEXT)")
+        conn.execute("CREATE TABLE SHIPMENT (USER_ID INTEGER, TRACKING_NUMBER TEXT)")
+        conn.executemany("INSERT INTO [USER] VALUES (?, ?, ?)",
+                         [(i, f"{tenant} user {i}", f"user{i}@{tenant}.com") for i in range(100)])
+        conn.executemany("INSERT INTO SHIPMENT VALUES (?, ?)",
+                         [(rng.randrange(100), number) for number in tracking_numbers if rng.random() < 0.3])
+        conn.execute("CREATE INDEX shipment_tracking ON SHIPMENT (TRACKING_NUMBER)")
+        conn.commit()
+        conn.close()
+        connections_info.append({'connection_string': path, 'database_name': tenant})
+    return connections_info
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_stage(stage: Callable[..., dict], *args) -> dict:
+    # A fresh process per stage, so each peak RSS belongs to that stage alone
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(stage, *args).result()
+
+
+def parse_stage(source: str, mode: ParseMode, use_snapshot: bool, log_path: str) -> dict:
+    # Instrumented like automate.py, so csv_parse and aggregation come out separately
+    instrumentation = Instrumentation(log_path)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            invoices, snapshot, _ = open_invoices(CSVParser(source, '', instrumentation), mode, True, use_snapshot,
+                                                  instrumentation)
+            count = sum(1 for _ in invoices)
+        except ImportError as e:
+            return {'skipped': str(e)}
+    seconds = time.perf_counter() - started
+    if snapshot is not None:
+        snapshot.close()
+    add_aggregation_span(instrumentation)
+    spans = {f"{name}_seconds": span for name, span in instrumentation.span_seconds.items()
+             if name != 'parse_and_aggregate'}
+    instrumentation.close()
+    return {'seconds': seconds, 'invoices': count, **spans, 'peak_rss_mb': peak_rss_mb()}
+
+
+def enrich_stage(source: str, connections_info: List[dict]) -> dict:
+    try:
+        from addUserInfo import enrich, read_airbills
+    except ImportError as e:
+        return {'skipped': str(e)}
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        enrich(read_airbills(source), connections_info, connect=sqlite3.connect)
+    return {'seconds': time.perf_counter() - started, 'peak_rss_mb': peak_rss_mb()}
+
+
+def render_stage(source: str, output_directory: str, cache_directory: str, backend: RenderBackend, api_url: str,
+                 concurrency: int, render_limit: int) -> dict:
+    os.makedirs(output_directory, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        invoices, snapshot, _ = open_invoices(CSVParser(source, ''), ParseMode.memory, True, True,
+                                              Instrumentation(enabled=False))
+        if render_limit:
+            invoices = islice(invoices, render_limit)
+        invoices = list(invoices)
+        # The invoices are built before the clock starts, so invoices per second measures rendering alone
+        started = time.perf_counter()
+        manifest = RunManifest(os.path.join(output_directory, 'manifest.jsonl'))
+        render_cache = RenderCache(cache_directory)
+        api = ApiConnector(output_directory, create_renderer(backend, api_url, concurrency), concurrency, manifest,
+                           render_cache)
+        api.save_invoices(invoices)
+        manifest.close()
+    if snapshot is not None:
+        snapshot.close()
+    elapsed = time.perf_counter() - started
+    return {'seconds': elapsed, 'invoices': len(invoices), 'invoices_per_second': len(invoices) / elapsed,
+            'failed': api.failed, 'skipped': api.skipped, 'cache_hits': render_cache.hits,
+            'peak_rss_mb': peak_rss_mb(), 'peak_rss_render_workers_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def main(rows: int = typer.Option(10000, help="Rows in the synthetic carrier file"),
+         customers: int = typer.Option(500, help="Distinct FULL_NAME values"),
+         charge_density: float = typer.Option(0.4, help="Probability that each of the 8 charge slots is filled"),
+         seed: int = typer.Option(0),
+         parse_modes: List[ParseMode] = typer.Option([mode.value for mode in ParseMode], "--parse-mode",
+                                                     help="Parse modes to time, repeat the option for several"),
+         snapshot: bool = typer.Option(True, help="Also time writing and reusing the memory-mode snapshot"),
+         backend: RenderBackend = typer.Option(RenderBackend.api, help="api renders against the local stub server"),
+         concurrency: int = typer.Option(8),
+         latency: float = typer.Option(0.05, help="Seconds the stub server waits per render"),
+         error_rate: float = typer.Option(0.0, help="Fraction of stub renders answered with HTTP 503"),
+         render_limit: int = typer.Option(0, help="Render only the first N invoices, 0 renders all"),
+         enrichment: bool = typer.Option(True, help="Time addUserInfo.enrich against SQLite stand-ins (needs pandas)"),
+         json_output: str = typer.Option('', help="Also write the results to this JSON file")):
+    results: Dict[str, object] = {'rows': rows, 'customers': customers, 'charge_density': charge_density}
+    stages: Dict[str, dict] = {}
+
+    with tempfile.TemporaryDirectory(prefix='invoices_bench_') as directory:
+        source = os.path.join(directory, 'carrier.csv')
+        started = time.perf_counter()
+        airbills = generate_carrier_file(source, rows, customers, charge_density, seed)
+        stages['generate'] = {'seconds': time.perf_counter() - started}
+        results['file_mb'] = os.path.getsize(source) / 1e6
+        log_path = os.path.join(directory, 'invoice_generator.log')
+
+        for mode in parse_modes:
+            mode_source = source
+            if mode == ParseMode.sorted:
+                mode_source = os.path.join(directory, 'carrier_sorted.csv')
+                generate_carrier_file(mode_source, rows, customers, charge_density, seed, sorted_by_customer=True)
+            stages[f"parse:{mode.value}"] = run_stage(parse_stage, mode_source, mode, False, log_path)
+            if mode == ParseMode.memory and snapshot:
+                stages['parse:memory+snapshot_write'] = run_stage(parse_stage, source, mode, True, log_path)
+                stages['parse:memory+snapshot_hit'] = run_stage(parse_stage, source, mode, True, log_path)
+
+        if enrichment:
+            connections_info = create_user_databases(directory, list(set(airbills)), seed)
+            stages['enrich'] = run_stage(enrich_stage, source, connections_info)
+
+        server = start_stub_server(latency=latency, error_rate=error_rate)
+        api_url = f"http://127.0.0.1:{server.server_address[1]}"
+        cache_directory = os.path.join(directory, 'render_cache')
+        first_output = os.path.join(directory, 'invoices')
+        # Cold, then resumed from the manifest, then into a new directory served by the render cache
+        for name, output_directory in [('render', first_output), ('render_resume', first_output),
+                                       ('render_from_cache', os.path.join(directory, 'invoices_again'))]:
+            stages[name] = run_stage(render_stage, source, output_directory, cache_directory, backend, api_url,
+                                     concurrency, render_limit)
+        server.shutdown()
+        results['stub_requests'] = server.requests_received
+
+    for name, value in results.items():
+        typer.echo(f"{name:32} {value:,.3f}" if isinstance(value, float) else f"{name:32} {value}")
+    for name, stage in stages.items():
+        if 'skipped' in stage and 'seconds' not in stage:
+            typer.echo(f"{name:32} skipped: {stage['skipped']}")
+            continue
+        details = ", ".join(f"{key} {value:,.3f}" if key.endswith('_seconds') else
+                            f"{key} {value:,.1f}" if isinstance(value, float) else f"{key} {value}"
+                            for key, value in stage.items() if key != 'seconds')
+        typer.echo(f"{name:32} {stage['seconds']:8.3f}s  {details}")
+    if json_output:
+        with open(json_output, 'w') as f:
+            json.dump({**results, 'stages': stages}, f, indent=2)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,191 @@
+import csv
+import hashlib
+import json
+import locale
+import os
+import sqlite3
+from typing import Callable, Dict, Iterator, List, Optional
+
+from models import Invoice, InvoiceBuilder
+from normalizer import NormalizeReport, normalize_rows
+
+CHECKPOINT_VERSION = 2
+# Bytes hashed at the start of the file and just before the checkpointed offset
+FINGERPRINT_SIZE = 64 * 1024
+
+
+def checkpoint_path(csv_name: str) -> str:
+    return os.path.splitext(csv_name)[0] + '.checkpoint.sqlite'
+
+
+def fingerprint(path: str, offset: int) -> str:
+    # Hashing the whole consumed prefix would cost a full read on every run; the head and the bytes
+    # right before the offset catch a file that was replaced or rewritten rather than appended to
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(min(offset, FINGERPRINT_SIZE)))
+        f.seek(max(0, offset - FINGERPRINT_SIZE))
+        digest.update(f.read(min(offset, FINGERPRINT_SIZE)))
+    return digest.hexdigest()
+
+
+class IncrementalIngest:
+    def __init__(self, csv_name: str, field_names: List[str], logo_mapping: Dict[str, str], normalize: bool = True,
+                 path: Optional[str] = None) -> None:
+        self.csv_name = csv_name
+        self.field_names = field_names
+        self.logo_mapping = logo_mapping
+        self.normalize = normalize
+        self.path = path or checkpoint_path(csv_name)
+        self.encoding = locale.getpreferredencoding(False)
+        self.offset = 0
+        self.consumed = 0
+        self.rows = 0
+        self.lines = 0
+        # Only the customers this run touches are loaded; the rest stay in the checkpoint untouched
+        self.builders: Dict[str, InvoiceBuilder] = {}
+        self.hashes: Dict[str, Optional[str]] = {}
+        self.customers = 0
+        self.pending: List[str] = []
+        self.affected: List[str] = []
+        self.held_back = 0
+        self.restarted = False
+        self.report = NormalizeReport()
+        self.conn = sqlite3.connect(self.path)
+        self._load()
+
+    def _load(self) -> None:
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        meta = {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+        if meta and meta['version'] != CHECKPOINT_VERSION:
+            self.restarted = True
+            self.conn.execute("DROP TABLE IF EXISTS customers")
+            self.conn.execute("DELETE FROM meta")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS customers (
+                full_name TEXT PRIMARY KEY,
+                state TEXT,
+                content_hash TEXT,
+                pending INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS customers_pending ON customers (pending)")
+        if not meta or self.restarted:
+            return
+        size = os.path.getsize(self.csv_name)
+        if (meta['normalized'] != self.normalize or size < meta['offset']
+                or fingerprint(self.csv_name, meta['offset']) != meta['fingerprint']):
+            self.restarted = True
+            # The hashes are kept, so the PDFs of customers whose invoice changed are still replaced
+            self.conn.execute("UPDATE customers SET state = NULL, pending = 0")
+            return
+        self.offset = meta['offset']
+        self.rows = meta['rows']
+        self.lines = meta['lines']
+        self.customers, = self.conn.execute("SELECT COUNT(*) FROM customers WHERE state IS NOT NULL").fetchone()
+        for name, state, content_hash in self.conn.execute(
+                "SELECT full_name, state, content_hash FROM customers WHERE pending = 1"):
+            self.builders[name] = InvoiceBuilder.from_state(self.logo_mapping, json.loads(state))
+            self.hashes[name] = content_hash
+        self.pending = list(self.builders)
+
+    def _builder(self, full_name: str) -> InvoiceBuilder:
+        builder = self.builders.get(full_name)
+        if builder is None:
+            stored = self.conn.execute("SELECT state, content_hash FROM customers WHERE full_name = ?",
+                                       (full_name,)).fetchone()
+            state, self.hashes[full_name] = stored or (None, None)
+            if state is None:
+                builder = InvoiceBuilder(self.logo_mapping)
+                self.customers += 1
+            else:
+                builder = InvoiceBuilder.from_state(self.logo_mapping, json.loads(state))
+            self.builders[full_name] = builder
+        return builder
+
+    def _complete_lines(self, f, final: bool) -> Iterator[str]:
+        for line in f:
+            # The export may still be writing its last row, unless the caller knows it is finished
+            if not line.endswith(b'\n') and not final:
+                self.held_back = len(line)
+                break
+            self.consumed += len(line)
+            self.lines += 1
+            yield line.decode(self.encoding)
+
+    def _records(self, reader) -> Iterator[List[str]]:
+        width = len(self.field_names)
+        for record in reader:
+            if record:
+                yield record[:width] + [''] * (width - len(record))
+
+    def update(self, final: bool = False) -> List[Invoice]:
+        affected = dict.fromkeys(self.pending)
+        first_line = self.lines
+        self.consumed = self.offset
+        self.held_back = 0
+        with open(self.csv_name, 'rb') as f:
+            f.seek(self.offset)
+            reader = csv.reader(self._complete_lines(f, final))
+            if self.offset == 0:
+                next(reader, None)
+            records = normalize_rows(reader, self.field_names, self.report) if self.normalize \
+                else self._records(reader)
+            for values in records:
+                row = dict(zip(self.field_names, values))
+                full_name = row['FULL_NAME']
+                self._builder(full_name).add_row(row)
+                affected[full_name] = None
+                self.rows += 1
+        self.offset = self.consumed
+        for bad_row in self.report.examples:
+            bad_row.line_number += first_line
+
+        self.affected = list(affected)
+        return [self.builders[name].build() for name in self.affected]
+
+    def summary(self) -> str:
+        restarted = "checkpoint no longer matches the file, started over; " if self.restarted else ""
+        held_back = (f"; the last {self.held_back} bytes have no line break yet and were left for the next run, "
+                     f"use --final if the export is finished" if self.held_back else "")
+        return (f"{restarted}{self.rows} rows consumed up to byte {self.offset}, "
+                f"{len(self.affected)} of {self.customers} customers to render{held_back}")
+
+    def commit(self, invoices: List[Invoice], content_hashes: List[str], rendered: Callable[[str], bool],
+               invoice_path: Callable[[Invoice, str], str]) -> int:
+        superseded = 0
+        pending = []
+        customers = []
+        for name, invoice, content_hash in zip(self.affected, invoices, content_hashes):
+            state = json.dumps(self.builders[name].state())
+            previous = self.hashes.get(name)
+            if not rendered(content_hash):
+                pending.append(name)
+                customers.append((name, state, previous, 1))
+                continue
+            if previous is not None and previous != content_hash:
+                previous_path = invoice_path(invoice, previous)
+                if os.path.exists(previous_path):
+                    os.remove(previous_path)
+                    superseded += 1
+            self.hashes[name] = content_hash
+            customers.append((name, state, content_hash, 0))
+        self.pending = pending
+
+        meta = {
+            'version': CHECKPOINT_VERSION,
+            'normalized': self.normalize,
+            'offset': self.offset,
+            'rows': self.rows,
+            'lines': self.lines,
+            'fingerprint': fingerprint(self.csv_name, self.offset),
+        }
+        # One transaction, so an interrupted run leaves the previous checkpoint as it was
+        self.conn.executemany("INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?)", customers)
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [(key, json.dumps(value)) for key, value in meta.items()])
+        self.conn.commit()
+        return superseded
+
+    def close(self) -> None:
+        self.conn.close()
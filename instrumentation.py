@@ -0,0 +1,153 @@
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar('T')
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def timed_call(function: Callable[..., T], *args) -> Tuple[T, float]:
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+class Instrumentation:
+    def __init__(self, log_path: str = 'invoice_generator.log', enabled: bool = True, run_id: str = None) -> None:
+        self.enabled = enabled
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.lock = threading.Lock()
+        self.span_seconds: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.render_latencies: List[float] = []
+        self.started = time.perf_counter()
+
+        self.logger = None
+        if enabled:
+            self.logger = logging.getLogger(f"invoice_generator.{self.run_id}")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            self.handler = logging.FileHandler(log_path)
+            self.handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(self.handler)
+
+    def emit(self, event: str, **fields) -> None:
+        if not self.enabled:
+            return
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'run': self.run_id, 'event': event}
+        record.update(fields)
+        self.logger.info(json.dumps(record))
+
+    def add_span(self, name: str, seconds: float, **fields) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.span_seconds[name] += seconds
+        self.emit('span', name=name, seconds=round(seconds, 6), **fields)
+
+    @contextmanager
+    def span(self, name: str, **fields):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - started, **fields)
+
+    # Charges the time spent producing each item to one span, for stages that run lazily inside a pipeline
+    def timed(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        elapsed = 0.0
+        items = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                break
+            elapsed += time.perf_counter() - started
+            items += 1
+            yield item
+        self.add_span(name, elapsed, items=items)
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def record_render(self, number: str, seconds: float, size: int) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.render_latencies.append(seconds)
+            self.counters['rendered'] += 1
+            self.counters['bytes_written'] += size
+        self.emit('render', number=number, seconds=round(seconds, 6), bytes=size)
+
+    # Hands the renders recorded so far to another process's Instrumentation, see merge()
+    def drain(self) -> Tuple[List[float], Dict[str, int]]:
+        with self.lock:
+            drained = self.render_latencies, dict(self.counters)
+            self.render_latencies = []
+            self.counters = defaultdict(int)
+        return drained
+
+    def merge(self, render_latencies: List[float], counters: Dict[str, int]) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.render_latencies.extend(render_latencies)
+            for name, value in counters.items():
+                self.counters[name] += value
+
+    def summary(self) -> dict:
+        latencies = sorted(self.render_latencies)
+        histogram = {}
+        for bound in LATENCY_BUCKETS:
+            histogram[f"<={bound}s"] = sum(1 for value in latencies if value <= bound)
+        histogram['inf'] = len(latencies)
+        wall_seconds = time.perf_counter() - self.started
+        return {
+            'wall_seconds': round(wall_seconds, 3),
+            'spans': {name: round(seconds, 3) for name, seconds in self.span_seconds.items()},
+            'counters': dict(self.counters),
+            'render_latency': {
+                'p50': round(percentile(latencies, 0.50), 4),
+                'p95': round(percentile(latencies, 0.95), 4),
+                'p99': round(percentile(latencies, 0.99), 4),
+                'max': round(latencies[-1], 4) if latencies else 0.0,
+                'histogram': histogram,
+            },
+            'invoices_per_second': round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        }
+
+    def close(self) -> dict:
+        if not self.enabled:
+            return {}
+        summary = self.summary()
+        self.emit('summary', **summary)
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+        return summary
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import struct
+import threading
+import zlib
+from email.utils import formatdate
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import requests
+import typer
+
+from pdf_writer import PngImage, decode_png
+
+
+class LogoCache:
+    def __init__(self, cache_directory: str = 'logo_cache', session: requests.Session = None,
+                 timeout: float = 10) -> None:
+        self.cache_directory = cache_directory
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.paths: Dict[str, str] = {}
+        self.data_uris: Dict[str, str] = {}
+        self.decoded: Dict[str, Optional[PngImage]] = {}
+        self.failures: Dict[str, Exception] = {}
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def _local_path(self, source: str) -> Optional[str]:
+        parsed = urlparse(source)
+        if parsed.scheme == 'file':
+            return parsed.path
+        if parsed.scheme in ('http', 'https'):
+            return None
+        return source
+
+    def _fetch(self, url: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        extension = os.path.splitext(urlparse(url).path)[1] or '.img'
+        path = os.path.join(self.cache_directory, key + extension)
+        meta_path = os.path.join(self.cache_directory, key + '.json')
+
+        # Revalidate what is already on disk instead of downloading the image again
+        headers = {}
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            headers['If-Modified-Since'] = meta.get('last_modified') or formatdate(os.path.getmtime(path),
+                                                                                  usegmt=True)
+
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if os.path.exists(path):
+                typer.echo(f"Using cached logo for {url} ({e})")
+                return path
+            raise
+        if r.status_code == 304:
+            return path
+        r.raise_for_status()
+
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(r.content)
+        os.replace(temporary_path, path)
+        with open(meta_path, 'w') as f:
+            json.dump({'url': url, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                       'content_type': r.headers.get('Content-Type')}, f)
+        return path
+
+    def path(self, source: str) -> str:
+        with self.lock:
+            # A logo that could not be fetched is not retried for every invoice of the run
+            if source in self.failures:
+                raise self.failures[source]
+            if source not in self.paths:
+                local_path = self._local_path(source)
+                try:
+                    self.paths[source] = local_path if local_path is not None else self._fetch(source)
+                except (OSError, requests.RequestException) as e:
+                    self.failures[source] = e
+                    raise
+            return self.paths[source]
+
+    def data_uri(self, source: str) -> str:
+        if source not in self.data_uris:
+            path = self.path(source)
+            content_type = mimetypes.guess_type(path)[0] or 'image/png'
+            with open(path, 'rb') as f:
+                encoded = base64.b64encode(f.read()).decode()
+            self.data_uris[source] = f"data:{content_type};base64,{encoded}"
+        return self.data_uris[source]
+
+    def image(self, source: str) -> Optional[PngImage]:
+        if source not in self.decoded:
+            with open(self.path(source), 'rb') as f:
+                data = f.read()
+            try:
+                self.decoded[source] = decode_png(data)
+            except (ValueError, KeyError, struct.error, zlib.error) as e:
+                typer.echo(f"Logo {source} cannot be drawn locally: {e}")
+                self.decoded[source] = None
+        return self.decoded[source]
+
+    def preload(self, sources: Iterable[str], decode: bool = False) -> None:
+        for source in set(sources):
+            try:
+                self.path(source)
+                if decode:
+                    self.image(source)
+            except (OSError, requests.RequestException) as e:
+                typer.echo(f"Logo {source} unavailable: {e}")
+
+    # Lets another process reuse logos this one already resolved without revalidating them
+    def resolved_paths(self) -> Dict[str, str]:
+        return dict(self.paths)
+
+    def seed(self, paths: Dict[str, str]) -> None:
+        with self.lock:
+            self.paths.update(paths)
+
+    def images(self) -> Dict[str, PngImage]:
+        return {source: image for source, image in self.decoded.items() if image is not None}
@@ -0,0 +1,90 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+UserInfo = Tuple[str, str, str]
+
+# Stays under SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+CHUNK_SIZE = 500
+
+
+class TrackingCache:
+    def __init__(self, path: str = 'tracking_cache.sqlite', positive_ttl: float = 30 * 86400,
+                 negative_ttl: float = 86400, bypass: bool = False, rebuild: bool = False) -> None:
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.bypass = bypass
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if bypass:
+            return
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tracking (
+                tracking_number TEXT PRIMARY KEY,
+                full_name TEXT,
+                email TEXT,
+                database_name TEXT,
+                found INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        if rebuild:
+            self.conn.execute("DELETE FROM tracking")
+        self.conn.commit()
+
+    # Returns the fresh cached entries (None marks a cached not-found) and the numbers that still need a query
+    def get_many(self, tracking_numbers: List[str]) -> Tuple[Dict[str, Optional[UserInfo]], List[str]]:
+        if self.bypass:
+            self.misses += len(tracking_numbers)
+            return {}, list(tracking_numbers)
+
+        now = time.time()
+        cached = {}
+        for start in range(0, len(tracking_numbers), CHUNK_SIZE):
+            chunk = tracking_numbers[start:start + CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.conn.execute(f"""
+                SELECT tracking_number, full_name, email, database_name, found, fetched_at
+                FROM tracking WHERE tracking_number IN ({placeholders})
+            """, chunk)
+            for tracking_number, full_name, email, database_name, found, fetched_at in rows:
+                ttl = self.positive_ttl if found else self.negative_ttl
+                if now - fetched_at <= ttl:
+                    cached[tracking_number] = (full_name, email, database_name) if found else None
+
+        missing = [number for number in tracking_numbers if number not in cached]
+        self.negative_hits += sum(1 for value in cached.values() if value is None)
+        self.hits += len(cached)
+        self.misses += len(missing)
+        return cached, missing
+
+    def put_many(self, found: Dict[str, UserInfo], not_found: Iterable[str]) -> None:
+        if self.bypass:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tracking VALUES (?, ?, ?, ?, 1, ?)",
+            [(number, full_name, email, database_name, now)
+             for number, (full_name, email, database_name) in found.items()]
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tracking VALUES (?, NULL, NULL, NULL, 0, ?)",
+            [(number, now) for number in not_found]
+        )
+        self.conn.commit()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"tracking cache: {self.hits} hits ({self.negative_hits} not-found), "
+                f"{self.misses} misses, hit rate {rate:.1%}")
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from models import Invoice
+from renderers import invoice_payload
+
+
+def invoice_hash(invoice: Invoice) -> str:
+    canonical = json.dumps(invoice_payload(invoice), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class RunManifest:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.records: Dict[str, dict] = {}
+        torn = False
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line can be cut short if a previous run was killed mid-write
+                        continue
+                    self.records[record['hash']] = record
+        self.journal = open(path, 'a')
+        if torn:
+            # End the cut-short line so the next record is not appended to it
+            self.journal.write('\n')
+
+    def is_done(self, content_hash: str) -> bool:
+        record = self.records.get(content_hash)
+        return record is not None and record['status'] == 'done' and os.path.exists(record['path'])
+
+    def record(self, content_hash: str, number: str, status: str, path: Optional[str] = None,
+               error: Optional[str] = None) -> None:
+        record = {'hash': content_hash, 'number': number, 'status': status, 'path': path, 'error': error,
+                  'at': datetime.now().isoformat(timespec='seconds')}
+        with self.lock:
+            self.records[content_hash] = record
+            self.journal.write(json.dumps(record) + '\n')
+            self.journal.flush()
+
+    def failed(self) -> int:
+        return sum(1 for record in self.records.values() if record['status'] == 'failed')
+
+    def close(self) -> None:
+        self.journal.close()
@@ -0,0 +1,240 @@
+import sys
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, List, Optional, Tuple
+
+FIELD_NAMES = [
+    "INVOICE #",
+    "INVOICE DATE",
+    "AIRBILL #",
+    "BILL OF LADING",
+    "SHIPPER ACCOUNT #",
+    "SHIPPER ACCOUNT NAME",
+    "SHIPPER ATTENTION",
+    "SHIPPER ADDRESS 1",
+    "SHIPPER ADDRESS 2",
+    "SHIPPER CITY",
+    "SHIPPER STATE",
+    "SHIPPER ZIP CODE",
+    "SHIPPER REFERENCE",
+    "CONSIGNEE NAME",
+    "CONSIGNEE ATTENTION",
+    "CONSIGNEE ADDRESS 1",
+    "CONSIGNEE ADDRESS 2",
+    "CONSIGNEE CITY",
+    "CONSIGNEE STATE",
+    "CONSIGNEE ZIP CODE",
+    "CONSIGNEE COUNTRY CODE",
+    "THIRD PARTY ACCOUNT #",
+    "THIRD PARTY ACCOUNT NAME",
+    "THIRD PARTY ADDRESS",
+    "THIRD PARTY ADDRESS.1",
+    "THIRD PARTY CITY",
+    "THIRD PARTY STATE",
+    "THIRD PARTY ZIP CODE",
+    "SHIPMENT DATE",
+    "PO #",
+    "CUST INV #",
+    "DEPT #",
+    "PRODUCT CODE",
+    "ZONE",
+    "BILLED WEIGHT",
+    "ACTUAL WEIGHT",
+    "DIMENSIONAL WEIGHT",
+    "PIECES",
+    "DIMENSIONS",
+    "BASE CHARGE TYPE",
+    "SHIPMENT TOTAL",
+    "BASE CHARGE AMOUNT",
+    "CHARGE 1 TYPE",
+    "CHARGE 1 AMT",
+    "CHARGE 2 TYPE",
+    "CHARGE 2 AMT",
+    "CHARGE 3 TYPE",
+    "CHARGE 3 AMT",
+    "CHARGE 4 TYPE",
+    "CHARGE 4 AMT",
+    "CHARGE 5 TYPE",
+    "CHARGE 5 AMT",
+    "CHARGE 6 TYPE",
+    "CHARGE 6 AMT",
+    "CHARGE 7 TYPE",
+    "CHARGE 7 AMT",
+    "CHARGE 8 TYPE",
+    "CHARGE 8 AMT",
+    "CREDIT 1 DESCRIPTION",
+    "CREDIT 1 AMT",
+    "CREDIT 2 DESCRIPTION",
+    "CREDIT 2 AMT",
+    "CREDIT 3 DESCRIPTION",
+    "CREDIT 3 AMT",
+    "REFERENCE 2",
+    "REFERENCE 3",
+    "REFERENCE 4",
+    "REFERENCE 5",
+    "CUSTOMERID",
+    "SCAC",
+    "CLASS",
+    "CHARGENOTES",
+    "RECEIVEDBY",
+    "RECEIVEDATE",
+    "FULL_NAME",
+    "EMAIL",
+    "DATABASE_NAME"
+]
+
+
+# Amounts under a billion with at most two decimals come out of float() exact to well within CENTS_TOLERANCE
+MAX_FLOAT_CENTS = 1e11
+CENTS_TOLERANCE = 1e-6
+
+
+def _decimal_to_cents(amount: str) -> int:
+    try:
+        value = Decimal(amount)
+        if value.is_finite():
+            return int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        pass
+    raise ValueError(f"not an amount: {amount!r}")
+
+
+def to_cents(amount: str) -> int:
+    if not amount:
+        return 0
+    try:
+        value = float(amount) * 100
+        cents = round(value)
+    except (ValueError, OverflowError):
+        raise ValueError(f"not an amount: {amount!r}") from None
+    # A third decimal may sit on a float rounding edge, so Decimal settles anything that is not whole cents
+    if abs(value - cents) < CENTS_TOLERANCE and abs(value) < MAX_FLOAT_CENTS:
+        return cents
+    return _decimal_to_cents(amount)
+
+
+class LineItem:
+    # An invoice can carry thousands of these, so no per-instance dict and the item name is only put together
+    # for the payload: the label is shared by every charge of a row and the charge type is interned
+    __slots__ = ('label', 'charge_type', 'quantity', 'unit_cost_cents')
+
+    def __init__(self, label: str, unit_cost_cents: int, charge_type: Optional[str] = None,
+                 quantity: int = 1) -> None:
+        self.label = label
+        self.charge_type = sys.intern(charge_type) if charge_type is not None else None
+        self.quantity = quantity
+        self.unit_cost_cents = unit_cost_cents
+
+    @property
+    def name(self) -> str:
+        return f"{self.label} - {self.charge_type}" if self.charge_type is not None else self.label
+
+    @property
+    def amount_cents(self) -> int:
+        return self.quantity * self.unit_cost_cents
+
+    def payload(self) -> dict:
+        return {'name': self.name, 'quantity': self.quantity, 'unit_cost': self.unit_cost_cents / 100}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, LineItem):
+            return NotImplemented
+        return (self.name, self.quantity, self.unit_cost_cents) == (other.name, other.quantity, other.unit_cost_cents)
+
+    def __repr__(self) -> str:
+        return f"LineItem({self.name!r}, quantity={self.quantity}, unit_cost_cents={self.unit_cost_cents})"
+
+
+@dataclass
+class Invoice:
+    __slots__ = ('from_who', 'to_who', 'logo', 'number', 'date', 'due_date', 'items', 'notes')
+    from_who: str
+    to_who: str
+    logo: str
+    number: str
+    date: str
+    due_date: str
+    items: List[LineItem]
+    notes: str
+
+
+CHARGE_KEYS = [(f"CHARGE {i} TYPE", f"CHARGE {i} AMT") for i in range(1, 9)]
+
+
+class InvoiceBuilder:
+    def __init__(self, logo_mapping: Dict[str, str]) -> None:
+        self.logo_mapping = logo_mapping
+        self.first_row = None
+        self.total_base_charge = 0
+        self.items: List[LineItem] = []
+        self.processed_airbills = set()
+
+    def add_row(self, row: dict) -> None:
+        charges = [(row[charge_type_key], to_cents(row[charge_amt_key]))
+                   for charge_type_key, charge_amt_key in CHARGE_KEYS
+                   if row[charge_type_key] and row[charge_amt_key]]
+        self.add_parsed(row, to_cents(row['BASE CHARGE AMOUNT']), row['AIRBILL #'], charges)
+
+    # For callers with amounts already in cents; row is only read for the customer's first row
+    def add_parsed(self, row: Optional[dict], base_charge: int, airbill_number: str,
+                   charges: List[Tuple[str, int]]) -> None:
+        if self.first_row is None:
+            self.first_row = row
+
+        # Whole cents, so the total is exact however many rows are added up
+        self.total_base_charge += base_charge
+
+        if airbill_number and airbill_number not in self.processed_airbills:
+            self.processed_airbills.add(airbill_number)
+            item_name = f"Airbill: {airbill_number}"
+        else:
+            item_name = "Other Charges"
+
+        for charge_type, charge_amt in charges:
+            self.items.append(LineItem(item_name, charge_amt, charge_type))
+
+    # Plain JSON-serializable state, so a customer's aggregate can be saved and picked up by a later run
+    def state(self) -> dict:
+        return {
+            'first_row': self.first_row,
+            'total_base_charge': self.total_base_charge,
+            'items': [[item.label, item.charge_type, item.unit_cost_cents, item.quantity] for item in self.items],
+            'processed_airbills': sorted(self.processed_airbills),
+        }
+
+    @classmethod
+    def from_state(cls, logo_mapping: Dict[str, str], state: dict) -> 'InvoiceBuilder':
+        builder = cls(logo_mapping)
+        builder.first_row = state['first_row']
+        builder.total_base_charge = state['total_base_charge']
+        builder.items = [LineItem(label, cents, charge_type, quantity)
+                         for label, charge_type, cents, quantity in state['items']]
+        builder.processed_airbills = set(state['processed_airbills'])
+        return builder
+
+    def build(self) -> Invoice:
+        items = self.items + summary_items(self.total_base_charge, len(self.processed_airbills))
+        return invoice_from_row(self.first_row, self.logo_mapping, items)
+
+
+def summary_items(total_base_charge: int, unique_airbills: int) -> List[LineItem]:
+    items = []
+    if total_base_charge > 0:
+        items.append(LineItem('Total Base Charge Amount', total_base_charge))
+    items.append(LineItem('Reporting fee', 250 * unique_airbills))
+    items.append(LineItem('Insured Value', 0))
+    return items
+
+
+# Header fields come from the customer's first row, shared by every aggregation path
+def invoice_from_row(first_row: dict, logo_mapping: Dict[str, str], items: List[LineItem]) -> Invoice:
+    return Invoice(
+        from_who=f"{first_row['FULL_NAME']} \n Email:{first_row['EMAIL']}, \n Service:{first_row['SCAC']}",
+        to_who=f"{first_row['CONSIGNEE ATTENTION']}\n{first_row['CONSIGNEE ADDRESS 1']}\n{first_row['CONSIGNEE ADDRESS 2']}",
+        logo=logo_mapping.get(first_row['DATABASE_NAME'].lower(), logo_mapping['default']),
+        number=first_row['DATABASE_NAME'],
+        date=first_row['INVOICE DATE'],
+        due_date='',
+        items=items,
+        notes=''
+    )
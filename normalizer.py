@@ -0,0 +1,164 @@
+import csv
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional
+
+import typer
+
+from models import FIELD_NAMES, to_cents
+
+BUFFER_SIZE = 1024 * 1024
+
+
+@dataclass
+class BadRow:
+    line_number: int
+    reason: str
+    values: List[str]
+
+
+@dataclass
+class NormalizeReport:
+    rows: int = 0
+    unwrapped: int = 0
+    padded: int = 0
+    truncated: int = 0
+    rejected: int = 0
+    examples: List[BadRow] = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (f"{self.rows} rows normalized: {self.unwrapped} unwrapped, {self.padded} padded, "
+                f"{self.truncated} truncated, {self.rejected} rejected")
+
+
+def amount_columns(field_names: List[str]) -> List[int]:
+    return [i for i, name in enumerate(field_names) if name.endswith(' AMT') or name == 'BASE CHARGE AMOUNT']
+
+
+def unwrap(record: List[str]) -> List[str]:
+    # deleteComillas.py / addUserInfo.py cases: the whole row is one quoted field with its inner quotes doubled
+    if len(record) == 1 and ',' in record[0]:
+        return next(csv.reader([record[0]]))
+    return record
+
+
+def normalize_rows(records: Iterable[List[str]], field_names: List[str], report: NormalizeReport,
+                   rejects=None) -> Iterator[List[str]]:
+    expected = len(field_names)
+    amounts = amount_columns(field_names)
+    for position, record in enumerate(records, start=1):
+        # csv.reader knows the physical line, which differs once a quoted field spans several lines
+        line_number = getattr(records, 'line_num', position)
+        if not record:
+            continue
+        values = unwrap(record)
+        if values is not record:
+            report.unwrapped += 1
+
+        reason = None
+        if len(values) > expected:
+            if any(value.strip() for value in values[expected:]):
+                reason = f"{len(values)} columns, expected {expected}"
+            else:
+                values = values[:expected]
+                report.truncated += 1
+        elif len(values) < expected:
+            values = values + [''] * (expected - len(values))
+            report.padded += 1
+
+        if reason is None:
+            for i in amounts:
+                if values[i]:
+                    try:
+                        to_cents(values[i])
+                    except ValueError:
+                        reason = f"{field_names[i]} is not a number: {values[i]!r}"
+                        break
+
+        if reason is not None:
+            report.rejected += 1
+            if len(report.examples) < 20:
+                report.examples.append(BadRow(line_number, reason, values))
+            if rejects is not None:
+                rejects.writerow([line_number, reason] + values)
+            continue
+
+        report.rows += 1
+        yield values
+
+
+def iter_normalized(source: str, field_names: List[str], report: NormalizeReport,
+                    rejects_path: Optional[str] = None) -> Iterator[List[str]]:
+    rejects_path = rejects_path or default_rejects_path(source)
+    try:
+        with open(source, 'r', newline='', buffering=BUFFER_SIZE) as f_in, \
+                open(rejects_path, 'w', newline='') as f_rejects:
+            reader = csv.reader(f_in)
+            rejects = csv.writer(f_rejects)
+            rejects.writerow(['LINE', 'REASON'] + field_names)
+            next(reader, None)
+            yield from normalize_rows(reader, field_names, report, rejects)
+    finally:
+        # Also when the consumer stops early, e.g. a sorted-mode run that finds the input unsorted
+        if not report.rejected:
+            os.remove(rejects_path)
+
+
+def normalize_file(source: str, destination: str, field_names: List[str],
+                   rejects_path: Optional[str] = None) -> NormalizeReport:
+    report = NormalizeReport()
+    rejects_path = rejects_path or os.path.splitext(destination)[0] + '.rejects.csv'
+    with open(destination, 'w', newline='', buffering=BUFFER_SIZE) as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(field_names)
+        writer.writerows(iter_normalized(source, field_names, report, rejects_path))
+    return report
+
+
+def normalized_path(csv_name: str) -> str:
+    return os.path.splitext(csv_name)[0] + '.normalized.csv'
+
+
+# Same place normalize_file puts them, whether or not the normalized rows are written out
+def default_rejects_path(csv_name: str) -> str:
+    return os.path.splitext(normalized_path(csv_name))[0] + '.rejects.csv'
+
+
+def benchmark(csv_name: str, field_names: List[str], rows: int) -> None:
+    with open(csv_name, 'r', newline='') as f:
+        lines = f.readlines()
+    header, body = lines[0], lines[1:] or [lines[0]]
+    with tempfile.TemporaryDirectory(prefix='normalizer_bench_') as directory:
+        source = os.path.join(directory, 'input.csv')
+        with open(source, 'w', newline='') as f:
+            f.write(header)
+            for i in range(rows):
+                f.write(body[i % len(body)])
+        size = os.path.getsize(source)
+
+        started = time.perf_counter()
+        report = normalize_file(source, os.path.join(directory, 'output.csv'), field_names)
+        elapsed = time.perf_counter() - started
+
+    typer.echo(report.summary())
+    typer.echo(f"{rows} rows, {size / 1e6:.1f} MB in {elapsed:.2f}s: "
+               f"{rows / elapsed:,.0f} rows/s, {size / 1e6 / elapsed:.1f} MB/s")
+
+
+def main(csv_name: str = typer.Argument(...),
+         output: str = typer.Option('', help="Normalized CSV, defaults to <input>.normalized.csv"),
+         benchmark_rows: int = typer.Option(0, help="Instead of normalizing, time a synthetic file of this many "
+                                                    "rows built by repeating the input")):
+    if benchmark_rows:
+        benchmark(csv_name, FIELD_NAMES, benchmark_rows)
+        return
+    report = normalize_file(csv_name, output or normalized_path(csv_name), FIELD_NAMES)
+    typer.echo(report.summary())
+    for bad_row in report.examples:
+        typer.echo(f"  line {bad_row.line_number}: {bad_row.reason}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
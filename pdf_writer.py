@@ -0,0 +1,208 @@
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Helvetica advance widths (1/1000 em) for ASCII 32..126, from the standard Adobe font metrics
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+
+def text_width(text: str, size: float) -> float:
+    return sum(HELVETICA_WIDTHS[ord(c) - 32] if 32 <= ord(c) <= 126 else 556 for c in text) * size / 1000
+
+
+@dataclass
+class PngImage:
+    width: int
+    height: int
+    components: int
+    pixels: bytes
+    alpha: Optional[bytes] = None
+
+
+def _paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def _unfilter(data: bytes, width: int, height: int, bpp: int) -> bytearray:
+    stride = width * bpp
+    out = bytearray(stride * height)
+    previous = bytearray(stride)
+    position = 0
+    for y in range(height):
+        filter_type = data[position]
+        line = bytearray(data[position + 1:position + 1 + stride])
+        position += 1 + stride
+        if filter_type == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            for i in range(stride):
+                line[i] = (line[i] + previous[i]) & 0xFF
+        elif filter_type == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                upper_left = previous[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + _paeth(left, previous[i], upper_left)) & 0xFF
+        elif filter_type != 0:
+            raise ValueError(f"Unknown PNG filter type {filter_type}")
+        out[y * stride:(y + 1) * stride] = line
+        previous = line
+    return out
+
+
+def decode_png(data: bytes) -> PngImage:
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("Not a PNG file")
+    position = 8
+    idat = []
+    palette = transparency = None
+    width = height = bit_depth = color_type = interlace = None
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'PLTE':
+            palette = chunk
+        elif chunk_type == b'tRNS':
+            transparency = chunk
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+    if bit_depth != 8 or interlace:
+        raise ValueError("Only 8-bit non-interlaced PNG logos are supported")
+
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color_type]
+    raw = _unfilter(zlib.decompress(b''.join(idat)), width, height, channels)
+
+    if color_type == 3:
+        alphas = transparency or b''
+        pixels = bytearray()
+        alpha = bytearray()
+        for index in raw:
+            pixels += palette[index * 3:index * 3 + 3]
+            alpha.append(alphas[index] if index < len(alphas) else 255)
+        return PngImage(width, height, 3, bytes(pixels), bytes(alpha) if transparency else None)
+    if color_type in (4, 6):
+        color = channels - 1
+        pixels = bytearray(width * height * color)
+        for c in range(color):
+            pixels[c::color] = raw[c::channels]
+        return PngImage(width, height, color, bytes(pixels), bytes(raw[color::channels]))
+    return PngImage(width, height, channels, bytes(raw))
+
+
+def _escape(text: str) -> bytes:
+    encoded = text.encode('cp1252', 'replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class PageCanvas:
+    def __init__(self) -> None:
+        self.operations: List[bytes] = []
+
+    def text(self, x: float, y: float, text: str, size: float = 10, bold: bool = False,
+             align: str = 'left') -> None:
+        if align == 'right':
+            x -= text_width(text, size)
+        font = b'/F2' if bold else b'/F1'
+        self.operations.append(b'BT %s %.2f Tf %.2f %.2f Td (%s) Tj ET' % (font, size, x, y, _escape(text)))
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, width: float = 0.5) -> None:
+        self.operations.append(b'%.2f w %.2f %.2f m %.2f %.2f l S' % (width, x1, y1, x2, y2))
+
+    def image(self, name: str, x: float, y: float, width: float, height: float) -> None:
+        self.operations.append(b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q' % (width, height, x, y, name.encode()))
+
+    def content(self) -> bytes:
+        return b'\n'.join(self.operations)
+
+
+class PdfDocument:
+    def __init__(self, page_width: float = 612, page_height: float = 792) -> None:
+        self.page_width = page_width
+        self.page_height = page_height
+        self.pages: List[PageCanvas] = []
+        self.images: Dict[str, PngImage] = {}
+
+    def add_page(self) -> PageCanvas:
+        page = PageCanvas()
+        self.pages.append(page)
+        return page
+
+    def add_image(self, image: PngImage) -> str:
+        name = f"Im{len(self.images) + 1}"
+        self.images[name] = image
+        return name
+
+    def to_bytes(self) -> bytes:
+        objects: List[bytes] = []
+
+        def add(body: bytes) -> int:
+            objects.append(body)
+            return len(objects)
+
+        def stream(dictionary: bytes, data: bytes) -> bytes:
+            return b'<<%s /Length %d>>\nstream\n%s\nendstream' % (dictionary, len(data), data)
+
+        catalog = add(b'')
+        pages = add(b'')
+        regular = add(b'<</Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding>>')
+        bold = add(b'<</Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding>>')
+
+        image_refs = []
+        for name, image in self.images.items():
+            color_space = b'/DeviceRGB' if image.components == 3 else b'/DeviceGray'
+            smask = b''
+            if image.alpha is not None:
+                mask = add(stream(b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray '
+                                  b'/BitsPerComponent 8 /Filter /FlateDecode' % (image.width, image.height),
+                                  zlib.compress(image.alpha)))
+                smask = b' /SMask %d 0 R' % mask
+            ref = add(stream(b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+                             b'/BitsPerComponent 8 /Filter /FlateDecode%s'
+                             % (image.width, image.height, color_space, smask),
+                             zlib.compress(image.pixels)))
+            image_refs.append(b'/%s %d 0 R' % (name.encode(), ref))
+
+        resources = b'<</Font <</F1 %d 0 R /F2 %d 0 R>> /XObject <<%s>>>>' % (regular, bold, b' '.join(image_refs))
+        page_refs = []
+        for page in self.pages:
+            content = add(stream(b'/Filter /FlateDecode', zlib.compress(page.content())))
+            page_refs.append(add(b'<</Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Resources %s '
+                                 b'/Contents %d 0 R>>'
+                                 % (pages, self.page_width, self.page_height, resources, content)))
+
+        objects[catalog - 1] = b'<</Type /Catalog /Pages %d 0 R>>' % pages
+        objects[pages - 1] = b'<</Type /Pages /Kids [%s] /Count %d>>' % (
+            b' '.join(b'%d 0 R' % ref for ref in page_refs), len(page_refs))
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            out += b'%010d 00000 n \n' % offset
+        out += b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref)
+        return bytes(out)
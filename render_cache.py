@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+
+# Batch workers share the directory, so after storing this fraction of max_bytes the real size is read again
+RESCAN_FRACTION = 16
+
+
+class RenderCache:
+    def __init__(self, directory: str = 'render_cache', max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self.stored_since_scan = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def key(self, renderer_identity: str, content_hash: str) -> str:
+        # The same invoice renders to different documents depending on the backend, endpoint and logo handling
+        return hashlib.sha256(f"{renderer_identity}:{content_hash}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def lookup(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            # Touching the entry on every hit turns mtime order into least-recently-used order
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def copy_to(self, key: str, destination: str) -> bool:
+        path = self.lookup(key)
+        if path is None:
+            return False
+        if os.path.exists(destination) and os.path.samefile(path, destination):
+            return True
+        temporary_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(path, temporary_path)
+        except OSError:
+            # Cross-device or a filesystem without hard links
+            shutil.copyfile(path, temporary_path)
+        os.replace(temporary_path, destination)
+        return True
+
+    def store(self, key: str, pdf: bytes) -> None:
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        self._add(key, temporary_path, len(pdf))
+
+    def store_file(self, key: str, source: str) -> None:
+        # The mirror of copy_to: a freshly written PDF is linked in rather than kept twice
+        temporary_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(source, temporary_path)
+        except OSError:
+            shutil.copyfile(source, temporary_path)
+        self._add(key, temporary_path, os.path.getsize(temporary_path))
+
+    def _add(self, key: str, temporary_path: str, size: int) -> None:
+        path = self._path(key)
+        with self.lock:
+            try:
+                previous_size = os.path.getsize(path)
+            except FileNotFoundError:
+                previous_size = 0
+            os.replace(temporary_path, path)
+            self.total_bytes += size - previous_size
+            self.stored_since_scan += size
+            if self.total_bytes > self.max_bytes or self.stored_since_scan > self.max_bytes // RESCAN_FRACTION:
+                self._evict()
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process sharing the directory
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        self.total_bytes = sum(size for _, size, _ in entries)
+        self.stored_since_scan = 0
+        return entries
+
+    def _evict(self) -> None:
+        for _, size, path in sorted(self._scan()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+    def stats(self) -> str:
+        return (f"render cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.total_bytes / (1024 * 1024):.1f} MB in {self.directory}")
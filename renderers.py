@@ -0,0 +1,255 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+import typer
+from requests.adapters import HTTPAdapter
+
+from instrumentation import Instrumentation
+from logo_cache import LogoCache
+from models import Invoice
+from pdf_writer import PdfDocument, PngImage, decode_png, text_width
+
+
+class RenderBackend(str, Enum):
+    api = "api"
+    local = "local"
+
+
+class RenderError(Exception):
+    pass
+
+
+def invoice_payload(invoice: Invoice) -> dict:
+    return {
+        'from': invoice.from_who,
+        'to': invoice.to_who,
+        'logo': invoice.logo,
+        'number': invoice.number,
+        'date': invoice.date,
+        'due_date': invoice.due_date,
+        'items': [item.payload() for item in invoice.items],
+        'notes': invoice.notes
+    }
+
+
+def format_cents(cents: int) -> str:
+    sign = '-' if cents < 0 else ''
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}${dollars:,}.{cents:02d}"
+
+
+class Renderer(ABC):
+    name = ''
+
+    @abstractmethod
+    def render(self, invoice: Invoice) -> bytes:
+        pass
+
+    def executor(self, max_workers: int) -> Executor:
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    # Callable submitted to executor(), it must be picklable when the executor is a process pool
+    def render_task(self) -> Callable[[Invoice], bytes]:
+        return self.render
+
+    # Everything besides the invoice itself that changes the rendered PDF, used to key the render cache
+    def cache_identity(self) -> str:
+        return self.name
+
+
+class InvoiceGeneratorRenderer(Renderer):
+    name = 'api'
+    retry_status_codes = {429, 500, 502, 503, 504}
+
+    def __init__(self, url: str = 'https://invoice-generator.com', pool_size: int = 1, max_retries: int = 3,
+                 backoff_factor: float = 0.5, logo_cache: Optional[LogoCache] = None,
+                 instrumentation: Optional[Instrumentation] = None, timeout: Tuple[float, float] = (5, 60),
+                 max_retry_delay: float = 30) -> None:
+        self.headers = {"Content-Type": "application/json"}
+        self.url = url
+        self.logo_cache = logo_cache
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation(enabled=False)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # (connect, read) seconds, so a stalled connection is retried instead of blocking its worker for good
+        self.timeout = timeout
+        self.max_retry_delay = max_retry_delay
+
+        # One keep-alive pool shared by every worker thread, sized so no worker waits for a connection
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _retry_delay(self, attempt: int, response: requests.Response = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_retry_delay)
+        return min(self.backoff_factor * (2 ** attempt), self.max_retry_delay)
+
+    def _post_with_retry(self, payload: dict) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.instrumentation.count('retries')
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if r.status_code not in self.retry_status_codes or attempt == self.max_retries:
+                return r
+            typer.echo(f"Retrying {payload['number']} after HTTP {r.status_code}")
+            self.instrumentation.count('retries')
+            time.sleep(self._retry_delay(attempt, r))
+
+    def cache_identity(self) -> str:
+        logo_mode = 'inline' if self.logo_cache is not None else 'url'
+        return f"{self.name}:{self.url}:logo={logo_mode}"
+
+    def _inline_logo(self, logo: str) -> str:
+        # The service would otherwise download the same few logos again for every invoice
+        try:
+            return self.logo_cache.data_uri(logo)
+        except (OSError, requests.RequestException):
+            return logo
+
+    def render(self, invoice: Invoice) -> bytes:
+        payload = invoice_payload(invoice)
+        if self.logo_cache is not None and invoice.logo:
+            payload['logo'] = self._inline_logo(invoice.logo)
+        try:
+            r = self._post_with_retry(payload)
+        except requests.RequestException as e:
+            raise RenderError(str(e))
+        if r.status_code == 200 or r.status_code == 201:
+            return r.content
+        raise RenderError(r.text)
+
+
+class LocalPdfRenderer(Renderer):
+    name = 'local'
+    margin = 50
+    row_height = 18
+
+    def __init__(self, logos: Optional[Dict[str, PngImage]] = None) -> None:
+        self.logos = dict(logos or {})
+
+    def cache_identity(self) -> str:
+        # Invoices whose logo could not be loaded render without it
+        return f"{self.name}:logos={','.join(sorted(self.logos))}"
+
+    def executor(self, max_workers: int) -> Executor:
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_set_worker_renderer, initargs=(self,))
+
+    def render_task(self) -> Callable[[Invoice], bytes]:
+        return _render_with_worker_renderer
+
+    def _logo(self, logo: str) -> Optional[PngImage]:
+        if logo not in self.logos and os.path.isfile(logo):
+            with open(logo, 'rb') as f:
+                self.logos[logo] = decode_png(f.read())
+        return self.logos.get(logo)
+
+    def render(self, invoice: Invoice) -> bytes:
+        document = PdfDocument()
+        width, height = document.page_width, document.page_height
+        left, right = self.margin, width - self.margin
+        page = document.add_page()
+        y = height - self.margin
+
+        logo = self._logo(invoice.logo) if invoice.logo else None
+        if logo is not None:
+            scale = min(150 / logo.width, 60 / logo.height, 1)
+            logo_height = logo.height * scale
+            page.image(document.add_image(logo), left, y - logo_height, logo.width * scale, logo_height)
+
+        page.text(right, y - 24, "INVOICE", size=24, bold=True, align='right')
+        page.text(right, y - 42, f"# {invoice.number}", size=11, align='right')
+        page.text(right, y - 70, f"Date: {invoice.date}", align='right')
+        if invoice.due_date:
+            page.text(right, y - 84, f"Due Date: {invoice.due_date}", align='right')
+
+        y -= 110
+        for line in invoice.from_who.split('\n'):
+            page.text(left, y, line.strip())
+            y -= 13
+        y -= 10
+        page.text(left, y, "Bill To:", bold=True)
+        y -= 14
+        for line in invoice.to_who.split('\n'):
+            page.text(left, y, line.strip())
+            y -= 13
+
+        y -= 20
+        quantity_x, rate_x, amount_x = right - 170, right - 85, right
+        name_width = quantity_x - left - 60
+
+        def table_header(page, y):
+            page.text(left, y, "Item", bold=True)
+            page.text(quantity_x, y, "Quantity", bold=True, align='right')
+            page.text(rate_x, y, "Rate", bold=True, align='right')
+            page.text(amount_x, y, "Amount", bold=True, align='right')
+            page.line(left, y - 5, right, y - 5)
+            return y - self.row_height
+
+        y = table_header(page, y)
+        total = 0
+        for item in invoice.items:
+            if y < self.margin + self.row_height:
+                page = document.add_page()
+                y = table_header(page, height - self.margin)
+            amount = item.amount_cents
+            total += amount
+            name = item.name
+            while name and text_width(name, 10) > name_width:
+                name = name[:-2] + '…'
+            page.text(left, y, name)
+            page.text(quantity_x, y, str(item.quantity), align='right')
+            page.text(rate_x, y, format_cents(item.unit_cost_cents), align='right')
+            page.text(amount_x, y, format_cents(amount), align='right')
+            y -= self.row_height
+
+        if y < self.margin + 3 * self.row_height:
+            page = document.add_page()
+            y = height - self.margin
+        page.line(rate_x - 80, y + 8, right, y + 8)
+        page.text(rate_x, y - 6, "Total:", bold=True, align='right')
+        page.text(amount_x, y - 6, format_cents(total), bold=True, align='right')
+
+        if invoice.notes:
+            y -= 40
+            page.text(left, y, "Notes:", bold=True)
+            for line in invoice.notes.split('\n'):
+                y -= 13
+                page.text(left, y, line)
+
+        return document.to_bytes()
+
+
+_worker_renderer: Optional[Renderer] = None
+
+
+def _set_worker_renderer(renderer: Renderer) -> None:
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def _render_with_worker_renderer(invoice: Invoice) -> bytes:
+    return _worker_renderer.render(invoice)
+
+
+def create_renderer(backend: RenderBackend, api_url: str = 'https://invoice-generator.com', concurrency: int = 1,
+                    max_retries: int = 3, logo_cache: Optional[LogoCache] = None,
+                    instrumentation: Optional[Instrumentation] = None) -> Renderer:
+    if backend == RenderBackend.local:
+        return LocalPdfRenderer(logo_cache.images() if logo_cache is not None else None)
+    return InvoiceGeneratorRenderer(api_url, pool_size=concurrency, max_retries=max_retries, logo_cache=logo_cache,
+                                    instrumentation=instrumentation)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+import typer
+
+from models import to_cents
+from normalizer import NormalizeReport
+
+MAGIC = b'INVSNAP1'
+SNAPSHOT_VERSION = 1
+# Stands for an empty amount cell, which aggregation tells apart from an explicit 0
+EMPTY = -2 ** 63
+ALIGNMENT = 8
+
+STRING_COLUMNS = ["INVOICE DATE", "AIRBILL #", "CONSIGNEE ATTENTION", "CONSIGNEE ADDRESS 1", "CONSIGNEE ADDRESS 2",
+                  "SCAC", "FULL_NAME", "EMAIL", "DATABASE_NAME"] + [f"CHARGE {i} TYPE" for i in range(1, 9)]
+AMOUNT_COLUMNS = ["BASE CHARGE AMOUNT"] + [f"CHARGE {i} AMT" for i in range(1, 9)]
+
+
+def snapshot_path(csv_name: str) -> str:
+    return os.path.splitext(csv_name)[0] + '.snapshot'
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_identity(path: str) -> dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path)}
+
+
+def write_snapshot(records: Iterable[List[str]], field_names: List[str], path: str, source: dict, normalized: bool,
+                   report: Optional[NormalizeReport] = None) -> int:
+    positions = {name: i for i, name in enumerate(field_names)}
+    width = len(field_names)
+    dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in STRING_COLUMNS}
+    codes = {name: array('i') for name in STRING_COLUMNS}
+    amounts = {name: array('q') for name in AMOUNT_COLUMNS}
+    string_columns = [(positions[name], dictionaries[name], codes[name]) for name in STRING_COLUMNS]
+    amount_columns = [(positions[name], amounts[name]) for name in AMOUNT_COLUMNS]
+
+    rows = 0
+    # Takes CSVParser.read_records() so the snapshot holds exactly what the CSV path would parse
+    for record in records:
+        if not record:
+            continue
+        if len(record) < width:
+            record = record + [''] * (width - len(record))
+        for position, dictionary, column in string_columns:
+            value = record[position]
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            column.append(code)
+        for position, column in amount_columns:
+            value = record[position]
+            column.append(to_cents(value) if value else EMPTY)
+        rows += 1
+
+    sections = []
+    for name in STRING_COLUMNS:
+        values = list(dictionaries[name])
+        text = ''.join(values)
+        offsets = array('q', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+        sections += [(f"{name}/codes", codes[name]), (f"{name}/offsets", offsets),
+                     (f"{name}/text", text.encode('utf-8'))]
+    sections += [(f"{name}/cents", amounts[name]) for name in AMOUNT_COLUMNS]
+
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout[name] = [offset, size, data.typecode if isinstance(data, array) else 'B']
+        offset += size + (-size % ALIGNMENT)
+    header = json.dumps({'version': SNAPSHOT_VERSION, 'byteorder': sys.byteorder, 'source': source,
+                         'normalized': normalized, 'report': report.summary() if report is not None else '',
+                         'rows': rows, 'sections': layout}).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for _, data in sections:
+                f.write(data)
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+        os.replace(temporary_path, path)
+    except OSError:
+        # A full disk must not leave a partial snapshot behind
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return rows
+
+
+class Snapshot:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not an invoice snapshot")
+        header_length, = struct.unpack_from('<Q', self.map, len(MAGIC))
+        body = len(MAGIC) + 8 + header_length
+        self.header = json.loads(self.map[len(MAGIC) + 8:body])
+        self.rows: int = self.header['rows']
+        self.report: str = self.header['report']
+        self.view = memoryview(self.map)
+        self.sections = {name: self.view[body + offset:body + offset + size].cast(typecode)
+                         for name, (offset, size, typecode) in self.header['sections'].items()}
+        self.dictionaries: Dict[str, List[str]] = {}
+
+    def matches(self, source_path: str, normalized: bool) -> bool:
+        header = self.header
+        if (header['version'] != SNAPSHOT_VERSION or header['byteorder'] != sys.byteorder
+                or header['normalized'] != normalized):
+            return False
+        stat = os.stat(source_path)
+        source = header['source']
+        if stat.st_size != source['size']:
+            return False
+        # An untouched mtime is trusted; otherwise the content decides, so a copy or touch does not force a rebuild
+        return stat.st_mtime_ns == source['mtime_ns'] or file_sha256(source_path) == source['sha256']
+
+    def codes(self, column: str) -> memoryview:
+        return self.sections[f"{column}/codes"]
+
+    def cents(self, column: str) -> memoryview:
+        return self.sections[f"{column}/cents"]
+
+    def values(self, column: str) -> List[str]:
+        if column not in self.dictionaries:
+            text = bytes(self.sections[f"{column}/text"]).decode('utf-8')
+            offsets = self.sections[f"{column}/offsets"].tolist()
+            self.dictionaries[column] = [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        return self.dictionaries[column]
+
+    def row(self, index: int) -> Dict[str, str]:
+        return {column: self.values(column)[self.codes(column)[index]] for column in STRING_COLUMNS}
+
+    def close(self) -> None:
+        for section in self.sections.values():
+            section.release()
+        self.view.release()
+        self.map.close()
+
+
+def load_snapshot(csv_name: str, normalized: bool, path: Optional[str] = None) -> Optional[Snapshot]:
+    path = path or snapshot_path(csv_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (ValueError, KeyError, struct.error):
+        return None
+    if not snapshot.matches(csv_name, normalized):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+def main(snapshot: str = typer.Argument(..., help="A .snapshot file written by automate.py")):
+    loaded = Snapshot(snapshot)
+    typer.echo(json.dumps({key: value for key, value in loaded.header.items() if key != 'sections'}, indent=2))
+    for column in STRING_COLUMNS:
+        typer.echo(f"{column:24} {len(loaded.values(column))} distinct values")
+    loaded.close()
+
+
+if __name__ == "__main__":
+    typer.run(main)
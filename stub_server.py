@@ -0,0 +1,85 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import typer
+
+# Smallest document most PDF readers will open, enough to stand in for invoice-generator.com output
+STUB_PDF = (b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+            b"2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n")
+
+
+class StubInvoiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests_received += 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            fail = server.requests_received <= server.fail_first or \
+                (server.error_rate and random.random() < server.error_rate)
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            if fail:
+                self._reply(503, b'{"error": "stub failure"}', 'application/json', server.retry_after)
+                return
+            try:
+                json.loads(body)
+            except ValueError:
+                self._reply(400, b'{"error": "invalid json"}', 'application/json')
+                return
+            self._reply(200, STUB_PDF, 'application/pdf')
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _reply(self, status: int, content: bytes, content_type: str, retry_after: str = ''):
+        self.send_response(status)
+        if retry_after:
+            self.send_header('Retry-After', retry_after)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port: int = 0, latency: float = 0.0, error_rate: float = 0.0, fail_first: int = 0,
+                      retry_after: str = '') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubInvoiceHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    # The first fail_first requests get a 503, which makes retries deterministic to test
+    server.fail_first = fail_first
+    server.retry_after = retry_after
+    server.requests_received = 0
+    server.in_flight = 0
+    server.peak_in_flight = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(port: int = typer.Option(8000),
+         latency: float = typer.Option(0.0, help="Seconds to wait before answering each request"),
+         error_rate: float = typer.Option(0.0, help="Fraction of requests answered with HTTP 503")):
+    server = start_stub_server(port, latency, error_rate)
+    typer.echo(f"Stub invoice API listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,77 @@
+import csv
+import os
+from typing import Dict, List, Optional
+
+import pytest
+
+from models import FIELD_NAMES, Invoice, LineItem
+from renderers import invoice_payload
+from stub_server import start_stub_server
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_invoice(number: str = 'esurex', customer: str = 'Customer 1') -> Invoice:
+    return Invoice(from_who=f"{customer} \n Email:c@example.com, \n Service:FDX", to_who='Consignee\n1 Main St\n',
+                   logo='', number=number, date='01/05/2024', due_date='',
+                   items=[LineItem('Airbill: 1', 1234, 'Fuel Surcharge'), LineItem('Reporting fee', 250)], notes='')
+
+
+def build_carrier_row(customer: str = 'Customer 1', airbill: str = '', base_charge: str = '1.50',
+                      fields: Optional[Dict[str, str]] = None) -> List[str]:
+    row = dict.fromkeys(FIELD_NAMES, '')
+    row.update({'FULL_NAME': customer, 'DATABASE_NAME': 'esurex', 'AIRBILL #': airbill,
+                'BASE CHARGE AMOUNT': base_charge})
+    row.update(fields or {})
+    return list(row.values())
+
+
+def write_rows(path: str, rows: List[List[str]], append: bool = False) -> None:
+    with open(path, 'a' if append else 'w', newline='') as f:
+        writer = csv.writer(f)
+        if not append:
+            writer.writerow(FIELD_NAMES)
+        writer.writerows(rows)
+
+
+def invoice_payloads(invoices) -> list:
+    return [invoice_payload(invoice) for invoice in invoices]
+
+
+@pytest.fixture
+def make_invoice():
+    return build_invoice
+
+
+@pytest.fixture
+def carrier_row():
+    return build_carrier_row
+
+
+@pytest.fixture
+def write_carrier_file():
+    return write_rows
+
+
+@pytest.fixture
+def payloads():
+    return invoice_payloads
+
+
+@pytest.fixture
+def repo_file():
+    return lambda name: os.path.join(REPO, name)
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server = start_stub_server(**options)
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,26 @@
+import pytest
+
+from automate import CSVParser
+from models import FIELD_NAMES
+from normalizer import normalize_file
+
+SAMPLES = ['tu_output.csv', 'test6.csv']
+
+
+@pytest.fixture(params=SAMPLES)
+def parser(request, tmp_path, repo_file) -> CSVParser:
+    # test6.csv has rows quoted as a whole, which only parse once normalized
+    normalized = str(tmp_path / 'normalized.csv')
+    normalize_file(repo_file(request.param), normalized, FIELD_NAMES)
+    return CSVParser(normalized, '')
+
+
+def test_columnar_matches_row_path(parser, payloads):
+    pytest.importorskip('pandas')
+    from aggregation import columnar_invoices
+
+    expected = parser.get_array_of_invoices()
+    assert expected
+    assert payloads(columnar_invoices(parser.csv_name, parser.field_names, parser.logo_mapping)) == \
+        payloads(expected)
+
@@ -0,0 +1,47 @@
+import random
+from decimal import ROUND_HALF_UP, Decimal
+
+import pytest
+
+from models import to_cents
+
+EDGE_CASES = ['', '0', '0.0', '-0.0', '12', '12.3', '12.34', '-12.34', '+3.5', '.5', '-.5', '5.', '00012.30',
+              '1.005', '-1.005', '1.0049', '2.675', '0.015', '999999999.995', '1e2', ' 12.50 ']
+INVALID = ['FE2', 'nan', 'inf', '-Infinity', '.', '-', '1.2.3', '--1', '1-', '12,50']
+
+
+def decimal_cents(amount: str) -> int:
+    return int((Decimal(amount) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)) if amount else 0
+
+
+def amounts(count: int) -> list:
+    rng = random.Random(0)
+    values = [f"{rng.uniform(-500, 5000):.{rng.choice([0, 1, 2, 2, 2, 3, 4])}f}" for _ in range(count)]
+    return values + EDGE_CASES
+
+
+@pytest.mark.parametrize('amount', EDGE_CASES)
+def test_edge_cases_round_half_up_like_decimal(amount):
+    assert to_cents(amount) == decimal_cents(amount)
+
+
+@pytest.mark.parametrize('amount', INVALID)
+def test_invalid_amounts_raise(amount):
+    with pytest.raises(ValueError):
+        to_cents(amount)
+
+
+def test_matches_decimal():
+    values = amounts(20000)
+    assert [to_cents(amount) for amount in values] == [decimal_cents(amount) for amount in values]
+
+
+def test_columnar_matches_to_cents():
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('pandas')
+    from aggregation import _to_cents
+
+    values = amounts(20000)
+    assert _to_cents(np.array(values, dtype=object)).tolist() == [to_cents(amount) for amount in values]
+    with pytest.raises(ValueError):
+        _to_cents(np.array(['1.50', 'FE2'], dtype=object))
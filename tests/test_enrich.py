@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from addUserInfo import enrich  # noqa: E402
+
+
+def create_database(path: str, users: dict) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE [USER] (USER_ID INTEGER, FULL_NAME TEXT, EMAIL TEXT)")
+    conn.execute("CREATE TABLE SHIPMENT (USER_ID INTEGER, TRACKING_NUMBER TEXT)")
+    for user_id, (tracking_number, full_name) in enumerate(users.items()):
+        conn.execute("INSERT INTO [USER] VALUES (?, ?, ?)", (user_id, full_name, f"{user_id}@example.com"))
+        conn.execute("INSERT INTO SHIPMENT VALUES (?, ?)", (user_id, tracking_number))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def databases(tmp_path) -> list:
+    first, second = str(tmp_path / 'esurex.sqlite'), str(tmp_path / 'assurem.sqlite')
+    create_database(first, {'100': 'First Owner', '400': 'Fourth Owner'})
+    create_database(second, {'100': 'Second Owner', '200': 'Only In Second'})
+    return [{'connection_string': first, 'database_name': 'esurex'},
+            {'connection_string': second, 'database_name': 'assurem'}]
+
+
+def test_queries_are_chunked(databases):
+    statements = []
+
+    def connect(path):
+        conn = sqlite3.connect(path)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    enrich(pd.DataFrame({'AIRBILL #': ['300', '100', '200', '100', '400']}), databases, connect=connect,
+           chunk_size=2)
+    # Four distinct numbers in chunks of two, against each of the two databases
+    assert sum('SELECT' in statement for statement in statements) == 2 * 2
+
+
+def test_first_database_wins_and_unknown_numbers_are_empty(databases):
+    df = pd.DataFrame({'AIRBILL #': ['300', '100', '200', '100', '400'], 'FULL_NAME': ['stale'] * 5})
+    enriched = enrich(df, databases, connect=sqlite3.connect, chunk_size=2)
+
+    # Row order is kept, including the repeated airbill
+    assert enriched['AIRBILL #'].tolist() == ['300', '100', '200', '100', '400']
+    assert enriched['FULL_NAME'].tolist() == ['', 'First Owner', 'Only In Second', 'First Owner', 'Fourth Owner']
+    assert enriched['DATABASE_NAME'].tolist() == ['', 'esurex', 'assurem', 'esurex', 'esurex']
+    assert enriched['EMAIL'].tolist()[0] == ''
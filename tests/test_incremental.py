@@ -0,0 +1,82 @@
+import os
+
+from automate import CSVParser, invoice_hash
+from incremental import IncrementalIngest
+from models import FIELD_NAMES
+
+LOGO_MAPPING = CSVParser('', '').logo_mapping
+
+
+def customer_rows(carrier_row, customers, airbill_prefix: str) -> list:
+    return [carrier_row(f"Customer {customer}", f"{airbill_prefix}{customer}", '2.50') for customer in customers]
+
+
+def run(path: str, rendered=lambda content_hash: True) -> IncrementalIngest:
+    ingest = IncrementalIngest(path, FIELD_NAMES, LOGO_MAPPING)
+    invoices = ingest.update()
+    hashes = [invoice_hash(invoice) for invoice in invoices]
+    ingest.commit(invoices, hashes, rendered, lambda invoice, content_hash: '')
+    ingest.close()
+    return ingest
+
+
+def test_appended_rows_load_only_the_customers_they_touch(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'carrier.csv')
+    write_carrier_file(source, customer_rows(carrier_row, range(100), 'A'))
+    assert run(source).customers == 100
+
+    write_carrier_file(source, customer_rows(carrier_row, [3, 7], 'B'), append=True)
+    ingest = IncrementalIngest(source, FIELD_NAMES, LOGO_MAPPING)
+    invoices = ingest.update()
+    assert sorted(ingest.builders) == ['Customer 3', 'Customer 7']
+    assert ingest.customers == 100
+    # Each total carries on from the restored state: one row from the first run and one appended
+    assert [item.unit_cost_cents for invoice in invoices for item in invoice.items
+            if item.label == 'Total Base Charge Amount'] == [500, 500]
+    ingest.close()
+
+
+def test_unrendered_customers_are_retried_on_the_next_run(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'carrier.csv')
+    write_carrier_file(source, customer_rows(carrier_row, range(10), 'A'))
+    failed = {invoice_hash(invoice) for invoice in IncrementalIngest(source, FIELD_NAMES, LOGO_MAPPING).update()
+              if invoice.from_who.startswith('Customer 4 ')}
+    run(source, rendered=lambda content_hash: content_hash not in failed)
+
+    ingest = run(source)
+    assert ingest.affected == ['Customer 4']
+    assert run(source).affected == []
+
+
+def test_rewritten_file_starts_over(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'carrier.csv')
+    write_carrier_file(source, customer_rows(carrier_row, range(10), 'A'))
+    run(source)
+
+    write_carrier_file(source, customer_rows(carrier_row, range(5), 'C'))
+    ingest = run(source)
+    assert ingest.restarted
+    assert ingest.customers == 5
+    assert len(ingest.affected) == 5
+
+
+def test_unterminated_last_row_is_reported_and_taken_with_final(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'carrier.csv')
+    write_carrier_file(source, customer_rows(carrier_row, range(3), 'A'))
+    with open(source, 'rb+') as f:
+        f.truncate(f.seek(0, 2) - 2)
+
+    ingest = IncrementalIngest(source, FIELD_NAMES, LOGO_MAPPING)
+    ingest.update()
+    assert ingest.rows == 2
+    assert ingest.held_back > 0
+    assert '--final' in ingest.summary()
+    ingest.close()
+
+    ingest = IncrementalIngest(source, FIELD_NAMES, LOGO_MAPPING)
+    invoices = ingest.update(final=True)
+    assert ingest.rows == 3
+    assert ingest.held_back == 0
+    assert ingest.offset == os.path.getsize(source)
+    assert len(invoices) == 3
+    ingest.close()
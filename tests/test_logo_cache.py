@@ -0,0 +1,91 @@
+import base64
+import struct
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from logo_cache import LogoCache
+
+
+def png(width: int = 2, height: int = 2) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    # Filter byte 0 and one grey pixel value per column
+    rows = b''.join(b'\x00' + b'\x80' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class LogoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.path != '/logo.png':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        content = png()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def logo_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LogoHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_local_and_file_sources_are_used_in_place(tmp_path):
+    logo = tmp_path / 'logo.png'
+    logo.write_bytes(png())
+    cache = LogoCache(str(tmp_path / 'cache'))
+    assert cache.path(str(logo)) == str(logo)
+    assert cache.path(logo.as_uri()) == str(logo)
+    assert cache.data_uri(str(logo)) == f"data:image/png;base64,{base64.b64encode(png()).decode()}"
+    assert cache.image(str(logo)).width == 2
+
+
+def test_non_png_logo_is_not_drawn(tmp_path):
+    logo = tmp_path / 'logo.jpg'
+    logo.write_bytes(b'\xff\xd8\xff\xe0 not a png')
+    cache = LogoCache(str(tmp_path / 'cache'))
+    assert cache.image(str(logo)) is None
+    assert cache.data_uri(str(logo)).startswith('data:image/jpeg;base64,')
+
+
+def test_failure_is_remembered(tmp_path, logo_server):
+    server, url = logo_server
+    cache = LogoCache(str(tmp_path / 'cache'))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            cache.path(f"{url}/missing.png")
+    assert len(server.requests) == 1
+
+
+def test_cached_logo_is_revalidated_with_its_etag(tmp_path, logo_server):
+    server, url = logo_server
+    path = LogoCache(str(tmp_path / 'cache')).path(f"{url}/logo.png")
+
+    # A later run has the file on disk and only asks whether it changed
+    assert LogoCache(str(tmp_path / 'cache')).path(f"{url}/logo.png") == path
+    assert server.requests[1]['If-None-Match'] == '"v1"'
+    with open(path, 'rb') as f:
+        assert f.read() == png()
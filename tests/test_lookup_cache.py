@@ -0,0 +1,77 @@
+import pytest
+
+from lookup_cache import TrackingCache
+
+FOUND = {'100': ('First Owner', 'first@example.com', 'esurex')}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = TrackingCache(str(tmp_path / 'tracking.sqlite'), positive_ttl=1000, negative_ttl=10)
+    yield cache
+    cache.close()
+
+
+def age(cache: TrackingCache, tracking_number: str, seconds: float) -> None:
+    cache.conn.execute("UPDATE tracking SET fetched_at = fetched_at - ? WHERE tracking_number = ?",
+                       (seconds, tracking_number))
+    cache.conn.commit()
+
+
+def test_hits_and_misses_are_counted(cache):
+    cache.put_many(FOUND, ['200'])
+    cached, missing = cache.get_many(['100', '200', '300'])
+    assert cached == {'100': FOUND['100'], '200': None}
+    assert missing == ['300']
+    assert (cache.hits, cache.negative_hits, cache.misses) == (2, 1, 1)
+    assert '2 hits (1 not-found), 1 misses' in cache.stats()
+
+
+def test_found_entries_expire_after_the_positive_ttl(cache):
+    cache.put_many(FOUND, [])
+    age(cache, '100', 999)
+    assert cache.get_many(['100'])[0] == {'100': FOUND['100']}
+    age(cache, '100', 2)
+    assert cache.get_many(['100']) == ({}, ['100'])
+
+
+def test_not_found_entries_expire_after_the_negative_ttl(cache):
+    cache.put_many({}, ['200'])
+    age(cache, '200', 9)
+    assert cache.get_many(['200'])[0] == {'200': None}
+    age(cache, '200', 2)
+    assert cache.get_many(['200']) == ({}, ['200'])
+
+
+def test_bypass_never_touches_the_database(tmp_path):
+    path = tmp_path / 'tracking.sqlite'
+    cache = TrackingCache(str(path), bypass=True)
+    cache.put_many(FOUND, ['200'])
+    assert cache.get_many(['100', '200']) == ({}, ['100', '200'])
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert not path.exists()
+
+
+def test_rebuild_discards_every_entry(tmp_path):
+    path = str(tmp_path / 'tracking.sqlite')
+    cache = TrackingCache(path)
+    cache.put_many(FOUND, ['200'])
+    cache.close()
+
+    cache = TrackingCache(path, rebuild=True)
+    assert cache.get_many(['100', '200']) == ({}, ['100', '200'])
+    cache.close()
+
+
+def test_enrich_skips_the_databases_when_every_number_is_cached(cache):
+    pd = pytest.importorskip('pandas')
+    from addUserInfo import enrich
+
+    def connect(connection_string):
+        raise AssertionError(f"connected to {connection_string}")
+
+    cache.put_many(FOUND, ['200'])
+    enriched = enrich(pd.DataFrame({'AIRBILL #': ['200', '100']}),
+                      [{'connection_string': 'unreachable', 'database_name': 'esurex'}], connect=connect, cache=cache)
+    assert enriched['FULL_NAME'].tolist() == ['', 'First Owner']
+    assert enriched['DATABASE_NAME'].tolist() == ['', 'esurex']
@@ -0,0 +1,56 @@
+import json
+
+from manifest import RunManifest, invoice_hash
+
+
+def test_done_invoices_are_skipped_on_resume(tmp_path, make_invoice):
+    path = str(tmp_path / 'manifest.jsonl')
+    pdf = tmp_path / 'esurex_invoice.pdf'
+    pdf.write_bytes(b'%PDF')
+    done, failed = invoice_hash(make_invoice('esurex')), invoice_hash(make_invoice('assurem'))
+    manifest = RunManifest(path)
+    manifest.record(done, 'esurex', 'done', str(pdf))
+    manifest.record(failed, 'assurem', 'failed', error='HTTP 500')
+    manifest.close()
+
+    resumed = RunManifest(path)
+    assert resumed.is_done(done)
+    assert not resumed.is_done(failed)
+    assert resumed.failed() == 1
+    resumed.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path, make_invoice):
+    path = tmp_path / 'manifest.jsonl'
+    pdf = tmp_path / 'esurex_invoice.pdf'
+    pdf.write_bytes(b'%PDF')
+    content_hash = invoice_hash(make_invoice())
+    record = json.dumps({'hash': content_hash, 'number': 'esurex', 'status': 'done', 'path': str(pdf), 'error': None})
+    # A run killed mid-write leaves the last record without its end
+    path.write_text(record + '\n' + record[:20])
+
+    manifest = RunManifest(str(path))
+    assert list(manifest.records) == [content_hash]
+    assert manifest.is_done(content_hash)
+    manifest.record('later', 'assurem', 'failed', error='HTTP 500')
+    manifest.close()
+
+    # The record written after the torn line survives the next resume
+    resumed = RunManifest(str(path))
+    assert list(resumed.records) == [content_hash, 'later']
+    resumed.close()
+
+
+def test_done_invoice_whose_pdf_was_deleted_is_rendered_again(tmp_path, make_invoice):
+    path = str(tmp_path / 'manifest.jsonl')
+    pdf = tmp_path / 'esurex_invoice.pdf'
+    pdf.write_bytes(b'%PDF')
+    content_hash = invoice_hash(make_invoice())
+    manifest = RunManifest(path)
+    manifest.record(content_hash, 'esurex', 'done', str(pdf))
+    manifest.close()
+
+    pdf.unlink()
+    resumed = RunManifest(path)
+    assert not resumed.is_done(content_hash)
+    resumed.close()
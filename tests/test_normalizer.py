@@ -0,0 +1,41 @@
+import os
+import shutil
+
+from automate import CSVParser, ParseMode
+from models import FIELD_NAMES
+from normalizer import default_rejects_path, normalize_file, normalized_path
+
+
+def test_streamed_normalization_matches_normalized_file(tmp_path, repo_file, payloads):
+    source = str(tmp_path / 'test6.csv')
+    shutil.copy(repo_file('test6.csv'), source)
+    on_disk = str(tmp_path / 'on_disk.csv')
+    normalize_file(source, on_disk, FIELD_NAMES)
+
+    streamed = CSVParser(source, '', normalize=True)
+    assert payloads(streamed.get_array_of_invoices()) == payloads(CSVParser(on_disk, '').get_array_of_invoices())
+    assert streamed.report.rows > 0
+    assert not os.path.exists(normalized_path(source))
+
+
+def test_rejected_rows_are_written_while_streaming(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'bad.csv')
+    write_carrier_file(source, [carrier_row(base_charge='10.00'), carrier_row(base_charge='FE2')])
+
+    parser = CSVParser(source, '', normalize=True)
+    assert len(parser.get_array_of_invoices()) == 1
+    assert parser.report.rejected == 1
+    with open(default_rejects_path(source)) as f:
+        assert 'FE2' in f.read()
+
+
+def test_sorted_mode_yields_before_the_file_is_read(tmp_path, carrier_row, write_carrier_file):
+    source = str(tmp_path / 'sorted.csv')
+    write_carrier_file(source, [carrier_row(f"Customer {customer:02d}", f"{customer}{airbill}")
+                                for customer in range(50) for airbill in range(20)])
+
+    parser = CSVParser(source, '', normalize=True)
+    invoices = parser.iter_invoices(ParseMode.sorted)
+    next(invoices)
+    assert parser.report.rows < 50 * 20
+    assert len(list(invoices)) == 49
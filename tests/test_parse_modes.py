@@ -0,0 +1,29 @@
+import typer
+from typer.testing import CliRunner
+
+import automate
+from automate import CSVParser, ParseMode
+
+
+def by_customer(payloads: list) -> list:
+    return sorted(payloads, key=lambda payload: (payload['from'], payload['to']))
+
+
+def test_spill_matches_memory(repo_file, payloads):
+    parser = CSVParser(repo_file('tu_output.csv'), '')
+    memory = payloads(parser.iter_invoices(ParseMode.memory))
+    spilled = payloads(parser.iter_invoices(ParseMode.spill, partitions=4))
+    assert len(spilled) == len(memory) > 1
+    assert by_customer(spilled) == by_customer(memory)
+
+
+def test_sorted_mode_on_unsorted_input_exits_with_a_message(tmp_path, repo_file, stub, monkeypatch):
+    _, url = stub()
+    monkeypatch.chdir(tmp_path)
+    app = typer.Typer()
+    app.command()(automate.main)
+    result = CliRunner().invoke(app, [repo_file('tu_output.csv'), '--parse-mode', 'sorted', '--api-url', url,
+                                      '--no-logo-cache', '--no-snapshot', '--no-metrics'])
+    assert result.exit_code == 1
+    assert 'use the spill parse mode' in result.output
+    assert 'Traceback' not in result.output
@@ -0,0 +1,98 @@
+import os
+
+from automate import ApiConnector
+from logo_cache import LogoCache
+from manifest import invoice_hash
+from render_cache import RenderCache
+from renderers import InvoiceGeneratorRenderer, LocalPdfRenderer
+from stub_server import start_stub_server
+
+
+def test_identity_separates_endpoints_and_logo_modes(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'))
+    identities = [
+        InvoiceGeneratorRenderer('http://127.0.0.1:8000').cache_identity(),
+        InvoiceGeneratorRenderer('https://invoice-generator.com').cache_identity(),
+        InvoiceGeneratorRenderer('https://invoice-generator.com',
+                                 logo_cache=LogoCache(str(tmp_path / 'logos'))).cache_identity(),
+        LocalPdfRenderer().cache_identity(),
+    ]
+    assert len({cache.key(identity, 'same-content') for identity in identities}) == len(identities)
+
+
+def test_stub_renders_are_not_reused_for_another_endpoint(make_invoice, tmp_path):
+    stub, production = start_stub_server(), start_stub_server()
+    try:
+        cache = RenderCache(str(tmp_path / 'cache'))
+        invoices = [make_invoice(customer=f"Customer {i}") for i in range(3)]
+        for server, output in [(stub, 'stub_run'), (production, 'production_run'), (production, 'second_run')]:
+            (tmp_path / output).mkdir()
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            ApiConnector(str(tmp_path / output), InvoiceGeneratorRenderer(url), render_cache=cache) \
+                .save_invoices(invoices)
+    finally:
+        stub.shutdown()
+        production.shutdown()
+
+    assert stub.requests_received == 3
+    # The first run against the other endpoint renders everything, the next one is served from the cache
+    assert production.requests_received == 3
+    assert cache.hits == 3
+
+
+def test_fresh_render_is_linked_into_the_cache(make_invoice, tmp_path, stub):
+    _, url = stub()
+    cache = RenderCache(str(tmp_path / 'cache'))
+    api = ApiConnector(str(tmp_path), InvoiceGeneratorRenderer(url), render_cache=cache)
+    invoice = make_invoice()
+    api.save_invoices([invoice])
+
+    output = api.invoice_path(invoice, invoice_hash(invoice))
+    assert os.path.samefile(cache.lookup(cache.key(api.renderer.cache_identity(), invoice_hash(invoice))), output)
+    assert cache.total_bytes == os.path.getsize(output)
+
+
+def test_store_file_copies_when_links_are_unavailable(tmp_path, monkeypatch):
+    source = tmp_path / 'invoice.pdf'
+    source.write_bytes(b'%PDF-1.4')
+
+    def no_links(source, destination):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(os, 'link', no_links)
+    cache = RenderCache(str(tmp_path / 'cache'))
+    cache.store_file(cache.key('local', 'copied'), str(source))
+    path = cache.lookup(cache.key('local', 'copied'))
+    assert not os.path.samefile(path, source)
+    with open(path, 'rb') as f:
+        assert f.read() == b'%PDF-1.4'
+
+
+def directory_bytes(directory) -> int:
+    return sum(path.stat().st_size for path in directory.glob('*.pdf'))
+
+
+def test_caches_sharing_a_directory_stay_under_the_limit(tmp_path):
+    directory = tmp_path / 'cache'
+    first, second = RenderCache(str(directory), 10_000), RenderCache(str(directory), 10_000)
+    for i in range(20):
+        first.store(first.key('local', f"first {i}"), b'x' * 1000)
+        second.store(second.key('local', f"second {i}"), b'x' * 1000)
+    assert directory_bytes(directory) <= 10_000
+
+
+def test_eviction_skips_entries_another_cache_removed(tmp_path, monkeypatch):
+    directory = tmp_path / 'cache'
+    cache = RenderCache(str(directory), 5_000)
+    for i in range(5):
+        cache.store(cache.key('local', str(i)), b'x' * 1000)
+
+    remove = os.remove
+
+    def removed_by_another_worker_first(path):
+        remove(path)
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', removed_by_another_worker_first)
+    cache.store(cache.key('local', 'one more'), b'x' * 1000)
+    assert directory_bytes(directory) <= 5_000
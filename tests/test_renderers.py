@@ -0,0 +1,86 @@
+import os
+import re
+import time
+import zlib
+
+import pytest
+
+from automate import ApiConnector
+from models import LineItem
+from renderers import InvoiceGeneratorRenderer, LocalPdfRenderer, Renderer, RenderError
+from stub_server import STUB_PDF, start_stub_server
+
+
+def test_503_is_retried_until_200(stub, make_invoice):
+    server, url = stub(fail_first=2)
+    renderer = InvoiceGeneratorRenderer(url, max_retries=3, backoff_factor=0.01)
+    assert renderer.render(make_invoice()) == STUB_PDF
+    assert server.requests_received == 3
+
+
+def test_gives_up_after_max_retries(stub, make_invoice):
+    server, url = stub(fail_first=10)
+    renderer = InvoiceGeneratorRenderer(url, max_retries=2, backoff_factor=0.01)
+    with pytest.raises(RenderError):
+        renderer.render(make_invoice())
+    assert server.requests_received == 3
+
+
+def test_retry_after_is_capped(stub, make_invoice):
+    server, url = stub(fail_first=1, retry_after='3600')
+    renderer = InvoiceGeneratorRenderer(url, max_retries=1, max_retry_delay=0.05)
+    started = time.perf_counter()
+    assert renderer.render(make_invoice()) == STUB_PDF
+    assert time.perf_counter() - started < 5
+
+
+def test_read_timeout_is_retried(stub, make_invoice):
+    server, url = stub(latency=1.0)
+    renderer = InvoiceGeneratorRenderer(url, max_retries=1, backoff_factor=0.01, timeout=(1, 0.1))
+    with pytest.raises(RenderError):
+        renderer.render(make_invoice())
+    assert server.requests_received == 2
+
+
+def test_concurrent_rendering(stub, make_invoice, tmp_path):
+    server, url = stub(latency=0.2)
+    invoices = [make_invoice(customer=f"Customer {i}") for i in range(16)]
+    api = ApiConnector(str(tmp_path), InvoiceGeneratorRenderer(url, pool_size=8), concurrency=8)
+    started = time.perf_counter()
+    api.save_invoices(invoices)
+    elapsed = time.perf_counter() - started
+
+    assert api.failed == 0
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.pdf')]) == 16
+    assert 1 < server.peak_in_flight <= 8
+    # 16 sequential renders would take at least 3.2s
+    assert elapsed < 16 * 0.2
+
+
+def page_contents(pdf: bytes) -> list:
+    streams = re.finditer(rb'<</Filter /FlateDecode /Length (\d+)>>\nstream\n', pdf)
+    return [zlib.decompress(pdf[match.end():match.end() + int(match.group(1))]) for match in streams]
+
+
+def test_renderer_must_implement_render():
+    with pytest.raises(TypeError):
+        Renderer()
+
+
+def test_local_renderer_writes_a_complete_pdf(make_invoice):
+    pdf = LocalPdfRenderer().render(make_invoice())
+    assert pdf.startswith(b'%PDF')
+    assert pdf.rstrip().endswith(b'%%EOF')
+    assert pdf.count(b'/Type /Page ') == 1
+
+
+def test_local_renderer_continues_long_item_lists_on_new_pages(make_invoice):
+    invoice = make_invoice()
+    invoice.items = [LineItem(f"Airbill: {i}", 100 + i, 'Fuel Surcharge') for i in range(100)]
+    pdf = LocalPdfRenderer().render(invoice)
+    pages = pdf.count(b'/Type /Page ')
+    assert pages > 1
+    assert b'/Count %d' % pages in pdf
+    # The last row and the total end up on the final page
+    assert b'(Airbill: 99' in page_contents(pdf)[-1]
+    assert b'(Total:)' in page_contents(pdf)[-1]
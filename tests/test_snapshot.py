@@ -0,0 +1,64 @@
+import os
+
+import automate
+from automate import CSVParser, ParseMode, open_invoices
+from instrumentation import Instrumentation
+from snapshot import snapshot_path
+
+ROWS = [('Customer 1', '1.50'), ('Customer 1', '2.25'), ('Customer 2', '3.00')]
+
+
+def load(path: str, normalize: bool = False):
+    invoices, snapshot, streamed_report = open_invoices(CSVParser(path, ''), ParseMode.memory, normalize, True,
+                                                        Instrumentation(enabled=False))
+    invoices = list(invoices)
+    if snapshot is not None:
+        snapshot.close()
+    return invoices, snapshot, streamed_report
+
+
+def test_snapshot_is_reused_until_a_row_changes(tmp_path, carrier_row, write_carrier_file, payloads, capsys):
+    path = str(tmp_path / 'carrier.csv')
+    write_carrier_file(path, [carrier_row(customer, base_charge=charge) for customer, charge in ROWS])
+    parsed, _, _ = load(path)
+    assert os.path.exists(snapshot_path(path))
+    capsys.readouterr()
+
+    reused, snapshot, _ = load(path)
+    assert 'parsed earlier' in capsys.readouterr().out
+    assert payloads(reused) == payloads(parsed)
+
+    # A touch changes the mtime but not the content, so the snapshot still holds
+    os.utime(path, ns=(snapshot.header['source']['mtime_ns'] + 10 ** 9,) * 2)
+    load(path)
+    assert 'parsed earlier' in capsys.readouterr().out
+
+    # Same size, different amount: only the content hash tells the snapshot is stale
+    write_carrier_file(path, [carrier_row(customer, base_charge=charge.replace('3.00', '4.00'))
+                              for customer, charge in ROWS])
+    rebuilt, _, _ = load(path)
+    assert 'parsed earlier' not in capsys.readouterr().out
+    assert payloads(rebuilt) != payloads(parsed)
+    assert payloads(load(path)[0]) == payloads(rebuilt)
+    assert 'parsed earlier' in capsys.readouterr().out
+
+
+def test_unwritable_snapshot_falls_back_to_the_csv(tmp_path, carrier_row, write_carrier_file, payloads, capsys,
+                                                    monkeypatch):
+    path = str(tmp_path / 'carrier.csv')
+    write_carrier_file(path, [carrier_row(customer, base_charge=charge) for customer, charge in ROWS])
+    expected = payloads(CSVParser(path, '').iter_invoices(ParseMode.memory))
+
+    def read_only_directory(records, *args):
+        for _ in records:
+            pass
+        raise PermissionError(13, 'Permission denied', snapshot_path(path))
+
+    monkeypatch.setattr(automate, 'write_snapshot', read_only_directory)
+    invoices, snapshot, streamed_report = load(path, normalize=True)
+    assert 'Could not write the snapshot' in capsys.readouterr().out
+    assert snapshot is None
+    assert payloads(invoices) == expected
+    # The rows read for the failed snapshot are not counted twice
+    assert streamed_report.rows == len(ROWS)
+    assert not os.path.exists(snapshot_path(path))